@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+generate a synthetic ROM collection and its SMDB, and time the parse,
+build and verify scripts on it (or the hashing of its files, see
+--hashing).
+"""
+import os
+import sys
+import json
+import math
+import time
+import zlib
+import random
+import shutil
+import hashlib
+import zipfile
+import argparse
+import platform
+import tempfile
+import subprocess
+import hashing
+
+
+__author__ = "aquaman"
+__date__ = "2026/10/18"
+__version__ = "$Revision: 1.2"
+
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+FILE_STRATEGIES = ["copy", "hardlink", "smart", "reflink", "clone"]
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Functions                                 #
+#                                                                      #
+# *********************************************************************#
+
+def option_parse():
+    """
+    Parse arguments from command line.
+    """
+    parser = argparse.ArgumentParser(
+        description=("time the parse, build and verify scripts on a "
+                     "synthetic ROM collection."))
+    # Add support for boolean arguments. Allows us to accept 1-argument forms
+    # of boolean flags whose values are any of "yes", "true", "t" or "1".
+    parser.register('type', 'bool', (lambda x: x.lower() in
+                                     ("yes", "true", "t", "1")))
+
+    parser.add_argument("-o", "--output",
+                        dest="output_file",
+                        default=None,
+                        help="write results as JSON (default: stdout)")
+
+    parser.add_argument("-w", "--work_folder",
+                        dest="work_folder",
+                        default=None,
+                        help=("new folder for the collection and the "
+                              "packs (default: a temporary folder, removed "
+                              "after the run)"))
+
+    parser.add_argument("-n", "--files",
+                        dest="files",
+                        default=500,
+                        type=int,
+                        help="number of distinct ROMs (default: 500)")
+
+    parser.add_argument("--min_size",
+                        dest="min_size",
+                        default=16 * 1024,
+                        type=int,
+                        help="smallest ROM, in bytes (default: 16 KiB)")
+
+    parser.add_argument("--max_size",
+                        dest="max_size",
+                        default=4 * 1024 * 1024,
+                        type=int,
+                        help="largest ROM, in bytes (default: 4 MiB)")
+
+    parser.add_argument("--size_distribution",
+                        choices=["loguniform", "uniform"],
+                        dest="size_distribution",
+                        default="loguniform",
+                        help=("distribution of ROM sizes between min_size "
+                              "and max_size (default: loguniform, as many "
+                              "small ROMs as large ones)"))
+
+    parser.add_argument("--zip_ratio",
+                        dest="zip_ratio",
+                        default=0.2,
+                        type=float,
+                        help=("fraction of ROMs stored in zip archives "
+                              "(default: 0.2)"))
+
+    parser.add_argument("--duplicate_ratio",
+                        dest="duplicate_ratio",
+                        default=0.1,
+                        type=float,
+                        help=("fraction of ROMs listed twice in the SMDB, "
+                              "in two folders of the pack (default: 0.1)"))
+
+    parser.add_argument("--seed",
+                        dest="seed",
+                        default=1,
+                        type=int,
+                        help="random seed (default: 1)")
+
+    parser.add_argument("--file_strategy",
+                        choices=FILE_STRATEGIES,
+                        dest="file_strategies",
+                        action="append",
+                        default=[],
+                        help=("build strategy to time (can be repeated, "
+                              "default: all)"))
+
+    parser.add_argument("-j", "--jobs",
+                        dest="jobs",
+                        default=1,
+                        type=int,
+                        help="number of hashing jobs of builds (default: 1)")
+
+    # Valid uses of this flag include: --hashing, --hashing true
+    parser.add_argument("--hashing",
+                        dest="hashing",
+                        default=False,
+                        nargs="?",
+                        const=True,
+                        type='bool',
+                        help=("time the hashing of the ROMs and of a large "
+                              "disc image (see --image_size) instead of the "
+                              "scripts: 128 KiB reads (previous method) "
+                              "against the hashing module, all digests, "
+                              "files in the page cache"))
+
+    parser.add_argument("--image_size",
+                        dest="image_size",
+                        default=2 ** 30,
+                        type=int,
+                        help=("size of the disc image, in bytes (see "
+                              "--hashing, default: 1 GiB)"))
+
+    # Valid uses of this flag include: --keep, --keep true
+    parser.add_argument("--keep",
+                        dest="keep",
+                        default=False,
+                        nargs="?",
+                        const=True,
+                        type='bool',
+                        help="keep the work folder after the run")
+
+    args = parser.parse_args()
+    # the collection and the packs are written from scratch, existing
+    # packs would turn the builds into --skip_existing runs
+    if (args.work_folder and os.path.isdir(args.work_folder) and
+            os.listdir(args.work_folder)):
+        parser.error("the work folder {} is not empty, use a new "
+                     "folder".format(args.work_folder))
+    return args
+
+
+def rom_sizes(number, min_size, max_size, distribution, rng):
+    """
+    return a list of random ROM sizes.
+    """
+    if distribution == "uniform":
+        return [rng.randint(min_size, max_size) for _ in range(number)]
+    low, high = math.log(min_size), math.log(max_size)
+    return [int(math.exp(rng.uniform(low, high))) for _ in range(number)]
+
+
+def make_corpus(work_folder, options):
+    """
+    write a source folder of unorganized ROMs (some of them zipped),
+    and the SMDB describing the pack built from them. Return the SMDB
+    file name, the number of source files and their total size.
+    """
+    rng = random.Random(options.seed)
+    source_folder = os.path.join(work_folder, "source")
+    os.makedirs(source_folder)
+    sizes = rom_sizes(options.files, options.min_size, options.max_size,
+                      options.size_distribution, rng)
+    records = []
+    for number, size in enumerate(sizes):
+        data = rng.getrandbits(8 * size).to_bytes(size, "little")
+        name = "Game {:05d}.bin".format(number)
+        records.append(("Benchmark/Folder {:03d}/{}".format(number // 100,
+                                                            name),
+                        hashlib.sha256(data).hexdigest(),
+                        hashlib.sha1(data).hexdigest(),
+                        hashlib.md5(data).hexdigest(),
+                        "{:08x}".format(zlib.crc32(data) & 0xffffffff),
+                        size))
+        if rng.random() < options.zip_ratio:
+            archive = os.path.join(source_folder,
+                                   "Game {:05d}.zip".format(number))
+            with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z:
+                z.writestr(name, data)
+        else:
+            with open(os.path.join(source_folder, name), "wb") as rom:
+                rom.write(data)
+
+    duplicates = rng.sample(records, int(len(records) *
+                                         options.duplicate_ratio))
+    for filename, sha256, sha1, md5, crc32, size in duplicates:
+        records.append(("Benchmark/Duplicates/" + os.path.basename(filename),
+                        sha256, sha1, md5, crc32, size))
+
+    target_database = os.path.join(work_folder, "smdb.txt")
+    with open(target_database, "w") as smdb:
+        for filename, sha256, sha1, md5, crc32, size in records:
+            print(sha256, filename, sha1, md5, crc32, size, sep="\t",
+                  file=smdb)
+
+    files, total_bytes = folder_size(source_folder)
+    return target_database, files, total_bytes
+
+
+def folder_size(folder):
+    """
+    return the number of files in a folder, and their total size.
+    """
+    files = total_bytes = 0
+    for dirpath, dirnames, filenames in os.walk(folder):
+        for f in filenames:
+            files += 1
+            total_bytes += os.path.getsize(os.path.join(dirpath, f))
+    return files, total_bytes
+
+
+def run_script(name, script, arguments, files, total_bytes):
+    """
+    run a script, and return its timing: wall-clock time, files and
+    megabytes (2**20 bytes) processed per second, and peak resident
+    memory (bytes, None if not available).
+    """
+    command = [sys.executable, os.path.join(SCRIPT_FOLDER, script)]
+    command += arguments
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    peak_rss = None
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+        process.returncode = returncode
+        # kilobytes on Linux, bytes on MacOS
+        peak_rss = usage.ru_maxrss
+        if not sys.platform.startswith("darwin"):
+            peak_rss *= 1024
+    else:
+        returncode = process.wait()
+        elapsed = time.perf_counter() - start
+    return {
+        "name": name,
+        "command": command[1:],
+        "returncode": returncode,
+        "seconds": round(elapsed, 4),
+        "files": files,
+        "bytes": total_bytes,
+        "files_per_second": round(files / elapsed, 2),
+        "megabytes_per_second": round(total_bytes / 2 ** 20 / elapsed, 2),
+        "peak_rss": peak_rss
+    }
+
+
+def git_revision():
+    """
+    return the current commit of the scripts, if known.
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=SCRIPT_FOLDER,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(work_folder, options):
+    """
+    return the timings of the scripts: one build per file strategy
+    (with the same source folder and SMDB), then parse and verify on
+    the pack built with the first strategy.
+    """
+    target_database, files, total_bytes = make_corpus(work_folder, options)
+    source_folder = os.path.join(work_folder, "source")
+    runs = []
+    packs = []
+    for file_strategy in options.file_strategies or FILE_STRATEGIES:
+        output_folder = os.path.join(work_folder, "pack_" + file_strategy)
+        packs.append(output_folder)
+        runs.append(run_script(
+            "build_pack " + file_strategy, "build_pack.py",
+            ["-i", source_folder, "-d", target_database,
+             "-o", output_folder, "--file_strategy", file_strategy,
+             "--jobs", str(options.jobs), "--no_cache", "-l"],
+            files, total_bytes))
+
+    pack_files, pack_bytes = folder_size(packs[0])
+    runs.append(run_script(
+        "parse_pack", "parse_pack.py",
+        ["-f", packs[0], "-o", os.path.join(work_folder, "parse.txt"),
+         "--no_cache", "-l"], pack_files, pack_bytes))
+    runs.append(run_script(
+        "verify_pack", "verify_pack.py",
+        ["-f", packs[0], "-d", target_database, "--no_cache", "-l"],
+        pack_files, pack_bytes))
+    return runs
+
+
+def read_hashes(filename):
+    """
+    return the hash values of a file, as the scripts did before the
+    hashing module: 128 KiB reads, each digest updated in turn.
+    """
+    sha256 = hashlib.sha256()
+    sha1 = hashlib.sha1()
+    md5 = hashlib.md5()
+    crc = 0
+    with open(filename, "rb", buffering=0) as f:
+        for b in iter(lambda: f.read(128 * 1024), b''):
+            sha256.update(b)
+            sha1.update(b)
+            md5.update(b)
+            crc = zlib.crc32(b, crc)
+    return {"sha256": sha256.hexdigest(),
+            "sha1": sha1.hexdigest(),
+            "md5": md5.hexdigest(),
+            "crc32": '{0:08x}'.format(crc & 0xffffffff)}
+
+
+def time_hashing(name, function, filenames):
+    """
+    hash files with function, and return the timing (as run_script).
+    """
+    total_bytes = sum(os.path.getsize(filename) for filename in filenames)
+    start = time.perf_counter()
+    for filename in filenames:
+        function(filename)
+    elapsed = time.perf_counter() - start
+    return {
+        "name": name,
+        "files": len(filenames),
+        "bytes": total_bytes,
+        "seconds": round(elapsed, 4),
+        "files_per_second": round(len(filenames) / elapsed, 2),
+        "megabytes_per_second": round(total_bytes / 2 ** 20 / elapsed, 2)
+    }
+
+
+def benchmark_hashing(work_folder, options):
+    """
+    return the timings of the two hashing methods (see read_hashes and
+    hashing.hash_file) on the ROMs of the collection, and on a large
+    disc image. Files are hashed once before being timed, so that they
+    are in the page cache.
+    """
+    make_corpus(work_folder, options)
+    source_folder = os.path.join(work_folder, "source")
+    roms = [os.path.join(source_folder, f)
+            for f in sorted(os.listdir(source_folder))]
+    image = os.path.join(work_folder, "image.iso")
+    rng = random.Random(options.seed)
+    block = rng.getrandbits(8 * 2 ** 20).to_bytes(2 ** 20, "little")
+    with open(image, "wb") as f:
+        for start in range(0, options.image_size, len(block)):
+            f.write(block[:options.image_size - start])
+
+    runs = []
+    for corpus, filenames in (("ROMs", roms), ("disc image", [image])):
+        for filename in filenames:
+            read_hashes(filename)
+        for method, function in (("128 KiB reads", read_hashes),
+                                 ("hashing module", hashing.hash_file)):
+            runs.append(time_hashing("{}, {}".format(corpus, method),
+                                     function, filenames))
+    return runs
+
+
+# *********************************************************************#
+#                                                                      #
+#                              Body                                    #
+#                                                                      #
+# *********************************************************************#
+
+if __name__ == '__main__':
+    args = option_parse()
+    WORK_FOLDER = args.work_folder
+    if WORK_FOLDER:
+        os.makedirs(WORK_FOLDER, exist_ok=True)
+    else:
+        WORK_FOLDER = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        if args.hashing:
+            RUNS = benchmark_hashing(WORK_FOLDER, args)
+        else:
+            RUNS = benchmark(WORK_FOLDER, args)
+    finally:
+        # a work folder given by the user is never removed
+        if not args.keep and not args.work_folder:
+            shutil.rmtree(WORK_FOLDER, ignore_errors=True)
+
+    RESULTS = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": {
+            "files": args.files,
+            "min_size": args.min_size,
+            "max_size": args.max_size,
+            "size_distribution": args.size_distribution,
+            "zip_ratio": args.zip_ratio,
+            "duplicate_ratio": args.duplicate_ratio,
+            "seed": args.seed,
+            "image_size": args.image_size if args.hashing else None
+        },
+        "runs": RUNS
+    }
+    if args.output_file:
+        with open(args.output_file, "w") as output_file:
+            json.dump(RESULTS, output_file, indent=1)
+            print(file=output_file)
+    else:
+        json.dump(RESULTS, sys.stdout, indent=1)
+        print(file=sys.stdout)
+
+    sys.exit(0)
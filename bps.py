@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+BPS patches (see the patches folder): build_pack applies them to the
+source files they were made for, and places the patched files (see
+--patches).
+
+A BPS patch starts with "BPS1", the sizes of the source and target
+files and metadata, followed by actions copying bytes from the source,
+the patch or the target itself, and ends with the CRC32 values of the
+source, the target and the patch.
+"""
+import os
+import zlib
+import struct
+from collections import defaultdict
+
+
+__author__ = "aquaman"
+__date__ = "2026/10/18"
+__version__ = "$Revision: 1.0"
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Constants                                 #
+#                                                                      #
+# *********************************************************************#
+
+MAGIC = b"BPS1"
+SUFFIX = ".bps"  # must be lowercase
+FOOTER = struct.Struct("<III")  # source, target and patch CRC32
+SOURCE_READ, TARGET_READ, SOURCE_COPY, TARGET_COPY = range(4)
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Functions                                 #
+#                                                                      #
+# *********************************************************************#
+
+def read_number(data, position):
+    """
+    return a variable-length number of a patch, and the position of
+    the next byte.
+    """
+    number = 0
+    shift = 1
+    while True:
+        byte = data[position]
+        position += 1
+        number += (byte & 0x7f) * shift
+        if byte & 0x80:
+            return number, position
+        shift <<= 7
+        number += shift
+
+
+def read_offset(data, position):
+    """
+    return a signed relative offset (SOURCE_COPY and TARGET_COPY), and
+    the position of the next byte.
+    """
+    number, position = read_number(data, position)
+    offset = number >> 1
+    return (-offset if number & 1 else offset), position
+
+
+class Patch(object):
+    """
+    a BPS patch, read in memory (patches are small), with its source
+    and target sizes and CRC32 hex values.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as patch:
+            self.data = patch.read()
+        if (not self.data.startswith(MAGIC) or
+                len(self.data) < len(MAGIC) + FOOTER.size):
+            raise ValueError("{} is not a BPS patch".format(filename))
+        source_crc, target_crc, patch_crc = FOOTER.unpack(
+            self.data[-FOOTER.size:])
+        if zlib.crc32(self.data[:-4]) & 0xffffffff != patch_crc:
+            raise ValueError("{} is damaged (CRC32)".format(filename))
+        self.source_crc = '{0:08x}'.format(source_crc)
+        self.target_crc = '{0:08x}'.format(target_crc)
+        position = len(MAGIC)
+        self.source_size, position = read_number(self.data, position)
+        self.target_size, position = read_number(self.data, position)
+        metadata_size, position = read_number(self.data, position)
+        self.actions = position + metadata_size
+
+    def apply(self, source):
+        """
+        yield the target file, piece by piece, from the source file
+        (opened in binary mode). The target is kept in memory, as
+        actions can copy any of its previous bytes. Raise ValueError
+        if the target is not the one expected by the patch.
+        """
+        data = self.data
+        end = len(data) - FOOTER.size
+        position = self.actions
+        target = bytearray()
+        source_offset = target_offset = 0
+        while position < end:
+            action, position = read_number(data, position)
+            command, length = action & 3, (action >> 2) + 1
+            if command == SOURCE_READ:
+                source.seek(len(target))
+                piece = source.read(length)
+            elif command == TARGET_READ:
+                piece = data[position:position + length]
+                position += length
+            elif command == SOURCE_COPY:
+                offset, position = read_offset(data, position)
+                source_offset += offset
+                source.seek(source_offset)
+                piece = source.read(length)
+                source_offset += length
+            else:
+                offset, position = read_offset(data, position)
+                target_offset += offset
+                # the copy can overlap the bytes it writes (runs of
+                # bytes), it then repeats the available ones
+                available = target[target_offset:target_offset + length]
+                if not available:
+                    raise ValueError("{} is damaged".format(self.filename))
+                piece = bytes((available * (length // len(available) + 1))
+                              [:length])
+                target_offset += length
+            if len(piece) != length:
+                raise ValueError("{} does not apply to {}".format(
+                    self.filename, source.name))
+            target += piece
+            yield piece
+        if (len(target) != self.target_size or
+                '{0:08x}'.format(zlib.crc32(target) & 0xffffffff) !=
+                self.target_crc):
+            raise ValueError("{} does not apply to {}".format(
+                self.filename, source.name))
+
+
+class PatchedFile(object):
+    """
+    the target of a patch applied to a source file, read like a file
+    (see Patch.apply).
+    """
+
+    def __init__(self, patch, source_filename):
+        self.source = open(source_filename, "rb")
+        self.pieces = patch.apply(self.source)
+        self.buffer = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.pieces)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def close(self):
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+class Patched(object):
+    """
+    a source file and the targets of its patches, opened like a zip
+    archive (see build_pack.extract_files): the names of its members
+    are the patch file names.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def open(self, patch_filename):
+        return PatchedFile(Patch(patch_filename), self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class PatchIndex(object):
+    """
+    the patches of a folder (and subfolders), found by the size and
+    CRC32 value of their source file.
+    """
+
+    def __init__(self, patch_folder):
+        self.patches = defaultdict(list)  # (size, crc32) -> patches
+        self.sizes = set()
+        self.errors = []
+        for dirpath, dirnames, filenames in os.walk(patch_folder):
+            for f in sorted(filenames):
+                if not f.lower().endswith(SUFFIX):
+                    continue
+                try:
+                    patch = Patch(os.path.join(dirpath, f))
+                except (OSError, ValueError) as error:
+                    self.errors.append(str(error))
+                    continue
+                self.patches[(patch.source_size, patch.source_crc)].append(
+                    patch)
+                self.sizes.add(patch.source_size)
+
+    def __len__(self):
+        return sum(len(patches) for patches in self.patches.values())
+
+    def find(self, size, crc):
+        """
+        return the patches made for a source file.
+        """
+        return self.patches.get((size, crc), [])
@@ -7,15 +7,45 @@ import os
 import sys
 import shutil
 import hashlib
+import json
 import argparse
 import zipfile
-from collections import defaultdict
-from collections import Counter
+import functools
+import smdb
+import journal
+import pipeline
+import output_tree
+import metrics
+import hashing
+import headers
+import bps
+import progress
+import hash_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 
 __author__ = "aquaman"
-__date__ = "2021/07/25"
-__version__ = "$Revision: 3.7"
+__date__ = "2026/10/18"
+__version__ = "$Revision: 5.7"
+
+HASH_CACHE = None  # set when the script is run, see hash_cache.py
+OUTPUT_TREE = output_tree.OutputTree()  # output folders, see output_tree.py
+PLAN = None  # list of actions, when planning a build (see --plan)
+METRICS = metrics.Metrics()  # run statistics, updated by all threads
+PROGRESS = None  # jsonl progress events, see progress.py
+PATCHES = None  # patches applied to source files, see --patches and bps.py
+EMPTY_SHA256 = ("e3b0c44298fc1c149afbf4c8996fb924"
+                "27ae41e4649b934ca495991b7852b855")
+FICLONE = 0x40049409  # ioctl request number (see linux/fs.h)
+# plan strategy of the entries extracted from each type of archive
+EXTRACT_STRATEGIES = {"zip": "extract", "headerless": "strip",
+                      "bps": "patch"}
+EXTRACT_METHODS = {strategy: method
+                   for method, strategy in EXTRACT_STRATEGIES.items()}
 
 
 # *********************************************************************#
@@ -37,32 +67,57 @@ if __name__ == '__main__':
 
     parser.add_argument("-i", "--input_folder",
                         dest="source_folder",
-                        required=True,
+                        default=None,
                         help="set source folder")
 
+    # -d, -o and -m can be repeated to build several packs at once,
+    # the nth output folder (and missing file) goes with the nth database
     parser.add_argument("-d", "--database",
                         dest="target_database",
-                        required=True,
+                        action="append",
+                        default=[],
                         help="set target database")
 
     parser.add_argument("-o", "--output_folder",
                         dest="output_folder",
-                        required=True,
+                        action="append",
+                        default=[],
                         help="set output folder")
 
     parser.add_argument("-m", "--missing",
                         dest="missing_files",
-                        default=None,
+                        action="append",
+                        default=[],
                         help="list missing files")
 
+    parser.add_argument("--report",
+                        dest="report_file",
+                        default=None,
+                        help=("write the status (found or missing) of each "
+                              "database entry, as JSON if the file name "
+                              "ends with .json, tab-separated otherwise"))
+
+    parser.add_argument("--manifest",
+                        dest="manifest",
+                        default=None,
+                        help=("build several packs from a tab-separated "
+                              "file: database, output folder and "
+                              "(optional) missing files, one pack per "
+                              "line"))
+
     parser.add_argument("--file_strategy",
-                        choices=["copy", "hardlink", "smart"],
+                        choices=["copy", "hardlink", "smart",
+                                 "reflink", "clone"],
                         dest="file_strategy",
                         default="copy",
                         help=("Strategy for how to get files into the output "
                               "folder. Smart uses copy for first instance of "
                               "a file and hardlinks to that first one for "
-                              "successive files."))
+                              "successive files. Reflink makes copy-on-write "
+                              "clones (btrfs, XFS), and falls back to "
+                              "in-kernel copies. Clone uses reflink for the "
+                              "first instance of a file and reflinks to "
+                              "that first one for successive files."))
 
     # Valid uses of this flag include: -s, -s true, -s yes, --skip_existing=1
     parser.add_argument("-s", "--skip_existing",
@@ -101,7 +156,139 @@ if __name__ == '__main__':
                         help=("Drops the 1st directory path in the SMDB file "
                               "so you can customize the name."))
 
+    parser.add_argument("-j", "--jobs",
+                        dest="jobs",
+                        default=1,
+                        type=int,
+                        help=("Number of files hashed concurrently "
+                              "(default: 1)."))
+
+    parser.add_argument("--write_jobs",
+                        dest="write_jobs",
+                        default=1,
+                        type=int,
+                        help=("Number of files copied concurrently, while "
+                              "other files are hashed (default: 1)."))
+
+    parser.add_argument("--queue_size",
+                        dest="queue_size",
+                        default=pipeline.QUEUE_SIZE,
+                        type=int,
+                        help=("Number of files waiting between two stages "
+                              "(scan, hash and write, default: {}).".format(
+                                  pipeline.QUEUE_SIZE)))
+
+    # Valid uses of this flag include: --crc_first, --crc_first true
+    parser.add_argument("--crc_first",
+                        dest="crc_first",
+                        default=False,
+                        nargs="?",
+                        const=True,
+                        type='bool',
+                        help=("Compute the CRC32 of each file first, and "
+                              "its SHA256 only if that CRC32 is in the "
+                              "database."))
+
+    # Valid uses of this flag include: --hash_archives, --hash_archives 1
+    parser.add_argument("--hash_archives",
+                        dest="hash_archives",
+                        default=False,
+                        nargs="?",
+                        const=True,
+                        type='bool',
+                        help=("Always compute the SHA256 of zip archives "
+                              "(by default, only if their size is in the "
+                              "database)."))
+
+    # Valid uses of this flag include: --headers, --headers 1
+    parser.add_argument("--headers",
+                        dest="headers",
+                        default=False,
+                        nargs="?",
+                        const=True,
+                        type='bool',
+                        help=("Also match ROMs without their iNES, SNES "
+                              "copier or Lynx header (hashed in the same "
+                              "pass), and write them without header."))
+
+    parser.add_argument("--patches",
+                        dest="patch_folder",
+                        default=None,
+                        help=("folder of BPS patches (.bps): source files "
+                              "matching the CRC32 value of a patch source "
+                              "are patched while being written, when the "
+                              "patched file is in the database."))
+
+    parser.add_argument("--cache",
+                        dest="cache_file",
+                        default=None,
+                        help=("set hash cache file (default: {})".format(
+                            hash_cache.default_cache_path())))
+
+    # Valid uses of this flag include: --no_cache, --no_cache true
+    parser.add_argument("--no_cache",
+                        dest="no_cache",
+                        default=False,
+                        nargs="?",
+                        const=True,
+                        type='bool',
+                        help=("Do not read or update the hash cache, "
+                              "hash every file."))
+
+    # Valid uses of this flag include: --rebuild_cache, --rebuild_cache 1
+    parser.add_argument("--rebuild_cache",
+                        dest="rebuild_cache",
+                        default=False,
+                        nargs="?",
+                        const=True,
+                        type='bool',
+                        help=("Ignore cached hash values, hash every file "
+                              "and refresh the hash cache."))
+
+    parser.add_argument("--plan",
+                        dest="plan_file",
+                        default=None,
+                        help=("identify files and write the list of "
+                              "actions to build the pack (tab-separated), "
+                              "without writing to the output folder"))
+
+    parser.add_argument("--execute",
+                        dest="execute_file",
+                        default=None,
+                        help=("carry out the actions listed by --plan "
+                              "(no other option is needed, see "
+                              "--write_jobs)"))
+
+    # Valid uses of this flag include: --resume, --resume true
+    parser.add_argument("--resume",
+                        dest="resume",
+                        default=False,
+                        nargs="?",
+                        const=True,
+                        type='bool',
+                        help=("Resume an interrupted build: keep the files "
+                              "placed by the previous run (see its journal "
+                              "in the output folder), and skip the source "
+                              "files it has completed."))
+
+    metrics.add_arguments(parser)
+    progress.add_arguments(parser)
+
     ARGS = parser.parse_args()
+    if ARGS.execute_file:
+        pass
+    elif not ARGS.source_folder:
+        parser.error("a source folder (-i) is required")
+    elif not ARGS.target_database and not ARGS.manifest:
+        parser.error("a database (-d) or a manifest (--manifest) is required")
+    if len(ARGS.output_folder) != len(ARGS.target_database):
+        parser.error("each database (-d) needs an output folder (-o)")
+    if len(ARGS.missing_files) > len(ARGS.target_database):
+        parser.error("too many missing files (-m)")
+    if ARGS.jobs < 1 or ARGS.write_jobs < 1:
+        parser.error("the number of jobs must be at least 1")
+    if ARGS.queue_size < 1:
+        parser.error("the queue size must be at least 1")
 
 
 def write_empty_file(dest):
@@ -115,20 +302,20 @@ def write_empty_file(dest):
     # When destination file exists...
     # Do nothing if skip_existing is set, otherwise remove file (to
     # avoid FileExistsError when writing new file).
-    if os.path.exists(dest):
+    if OUTPUT_TREE.exists(dest):
         if ARGS.skip_existing:
             return
         else:
             os.remove(dest)
+            OUTPUT_TREE.remove(dest)
 
     # Create directories if needed
     base_dir = os.path.dirname(os.path.abspath(dest))
-    if not os.path.exists(base_dir):
-        try:
-            os.makedirs(base_dir, exist_ok=True)
-        except (FileNotFoundError, OSError):
-            fixed_base_dir = u'\\\\?\\' + base_dir
-            os.makedirs(fixed_base_dir, exist_ok=True)
+    try:
+        OUTPUT_TREE.makedirs(base_dir)
+    except (FileNotFoundError, OSError):
+        fixed_base_dir = u'\\\\?\\' + base_dir
+        os.makedirs(fixed_base_dir, exist_ok=True)
 
     # Create empty file
     try:
@@ -136,99 +323,466 @@ def write_empty_file(dest):
     except (FileNotFoundError, OSError):
         fixed_dest = u'\\\\?\\' + os.path.abspath(dest)
         open(fixed_dest, 'a').close()
+    OUTPUT_TREE.add(dest, 0)
 
 
-def copy_file(source, dest, original):
+def resolve_strategy(source, dest, original):
     """
-    Copy a file from source to destination using a configurable file copy
-    strategy controlled by the --file_strategy command.
+    return the (strategy, source) tuple used to copy source to dest
+    (see --file_strategy), where strategy is copy, hardlink or reflink.
 
     Arguments:
       source   - The file to copy/hardlink
       dest     - The destination where the new file will be located
       original - The first file associated with a specific hash value
     """
-
     if (ARGS.file_strategy == "copy"):
-        copy_fn = shutil.copyfile
+        return "copy", source
     elif (ARGS.file_strategy == "hardlink"):
-        copy_fn = os.link
+        return "hardlink", source
     elif (ARGS.file_strategy == "smart"):
         if original == dest:
-            copy_fn = shutil.copyfile
-        else:
-            copy_fn = os.link
+            return "copy", source
+        return "hardlink", original
+    elif (ARGS.file_strategy == "reflink"):
+        return "reflink", source
+    elif (ARGS.file_strategy == "clone"):
+        if original != dest:
             source = original
+        return "reflink", source
+    raise Exception("Unknown copy strategy {}".format(ARGS.file_strategy))
+
+
+def copy_file(source, dest, original, strategy=None):
+    """
+    Copy a file from source to destination using a configurable file copy
+    strategy controlled by the --file_strategy command.
+
+    Arguments:
+      source   - The file to copy/hardlink
+      dest     - The destination where the new file will be located
+      original - The first file associated with a specific hash value
+      strategy - copy, hardlink or reflink source as is (by default,
+                 see resolve_strategy)
+    """
+
+    if strategy is None:
+        strategy, source = resolve_strategy(source, dest, original)
+    if (strategy == "copy"):
+        copy_fn = shutil.copyfile
+    elif (strategy == "hardlink"):
+        copy_fn = os.link
+    elif (strategy == "reflink"):
+        copy_fn = clone_file
     else:
-        raise Exception("Unknown copy strategy {}".format(ARGS.file_strategy))
+        raise Exception("Unknown copy strategy {}".format(strategy))
 
     # When destination file exists...
     # Do nothing if skip_existing is set, otherwise remove file (to
     # avoid FileExistsError when writing new file).
-    if os.path.exists(dest):
+    if OUTPUT_TREE.exists(dest):
         if ARGS.skip_existing:
             return
         else:
             os.remove(dest)
+            OUTPUT_TREE.remove(dest)
+            count("remove")
 
-    try:
-        # copy the file to the new directory
-        copy_fn(source, dest)
-    except FileNotFoundError:
-        # Windows' default API is limited to paths of 260 characters
-        fixed_dest = u'\\\\?\\' + os.path.abspath(dest)
-        copy_fn(source, fixed_dest)
-    except OSError:
+    count("copy_" + strategy)
+    with METRICS.phase("copy", "bytes_written") as phase:
+        if METRICS.detailed and strategy != "hardlink":
+            phase.bytes = os.path.getsize(source)
         try:
-            shutil.copyfile(source, dest)
+            # copy the file to the new directory
+            copy_fn(source, dest)
         except FileNotFoundError:
             # Windows' default API is limited to paths of 260 characters
             fixed_dest = u'\\\\?\\' + os.path.abspath(dest)
-            shutil.copyfile(source, fixed_dest)
+            copy_fn(source, fixed_dest)
+        except OSError:
+            try:
+                shutil.copyfile(source, dest)
+            except FileNotFoundError:
+                # Windows' default API is limited to paths of 260 characters
+                fixed_dest = u'\\\\?\\' + os.path.abspath(dest)
+                shutil.copyfile(source, fixed_dest)
+    OUTPUT_TREE.add(dest)
 
 
-def extract_file(filename, entry, method, dest):
+def clone_file(source, dest):
     """
-    extracts entry from archive to given destination directory
+    Copy a file without moving data through user space. Try a
+    copy-on-write clone first (FICLONE ioctl, btrfs and XFS), then an
+    in-kernel copy (os.copy_file_range, Linux), then a regular copy.
+
+    Arguments:
+      source - The file to clone
+      dest   - The destination where the new file will be located
     """
-    if method == 'zip':
-        # Stolen shamelessly from https://stackoverflow.com/a/4917469
-        # Eliminates the random directories that appear when a file is
-        # extracted from a zip file
-        with zipfile.ZipFile(filename) as zip_file:
-            for member in zip_file.namelist():
-                # skip other files in the zip
-                if member != entry:
-                    continue
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        if fcntl:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                count("reflinked")
+                return
+            except OSError:
+                pass  # not supported, or not on the same filesystem
+        if hasattr(os, "copy_file_range"):
+            size = os.fstat(src.fileno()).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    n = os.copy_file_range(src.fileno(), dst.fileno(),
+                                           size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+            except OSError:
+                pass
+            if copied == size:
+                count("copied_in_kernel")
+                return
+
+    # regular copy (the destination is truncated)
+    shutil.copyfile(source, dest)
+    count("copied")
+
+
+def extract_files(filename, method, extractions):
+    """
+    extracts entries from archive to given destinations, opening the
+    archive only once, and return the {destination: size} dictionary
+    of the destinations that were filled.
+
+    Arguments:
+      filename    - The archive
+      method      - The archive type (zip, headerless for a ROM
+                    without its header, see headers.py, or bps for a
+                    source file and the patches made for it, see bps.py)
+      extractions - A list of (entry, destinations) tuples, where
+                    destinations is a list of (path, sha256) tuples
+
+    Each entry is decompressed once, into its first destination, and
+    hashed on the fly. Entries are found using the CRC32 value stored
+    in the archive, so destinations expecting another sha256 value are
+    not filled (and remain available for another candidate). The
+    decompressed file is then copied (or hardlinked, see
+    --file_strategy) to the other confirmed destinations.
+    """
+    placed = {}
+    with open_archive(filename, method) as archive:
+        for entry, destinations in extractions:
+            # skip directories
+            if not os.path.basename(entry):
+                continue
+
+            pending = []
+            for dest, expected in destinations:
+                if ARGS.skip_existing and OUTPUT_TREE.exists(dest):
+                    placed[dest] = OUTPUT_TREE.getsize(dest)
+                else:
+                    pending.append((dest, expected))
+            if not pending:
+                continue
+
+            first = pending[0][0]
+            if PLAN is not None:
+                # verify the entry, without writing it
+                first = None
+            try:
+                sha256, size = extract_member(archive, entry, first)
+            except ValueError:
+                # patch not matching its source (see bps.Patch.apply)
+                sha256 = size = None
+            confirmed = [dest for dest, expected in pending
+                         if sha256 and (expected is None or
+                                        expected == sha256)]
+            if first:
+                OUTPUT_TREE.add(first, size)
+                if not confirmed:
+                    # CRC32 collision, discard output
+                    os.remove(first)
+                    OUTPUT_TREE.remove(first)
+            if not confirmed:
+                count(method + "_members_rejected")
+                continue
+            count(method + "_members_confirmed")
+            if PLAN is not None:
+                PLAN.append((filename, entry, confirmed[0],
+                             EXTRACT_STRATEGIES[method], sha256))
+                for dest in confirmed[1:]:
+                    plan_copy(confirmed[0], dest, confirmed[0], sha256)
+                placed.update(dict.fromkeys(confirmed, size))
+                continue
+            if confirmed[0] != first:
+                os.replace(first, confirmed[0])
+                OUTPUT_TREE.remove(first)
+                OUTPUT_TREE.add(confirmed[0], size)
+            for dest in confirmed[1:]:
+                copy_file(confirmed[0], dest, confirmed[0])
+            placed.update(dict.fromkeys(confirmed, size))
+    return placed
+
+
+def open_archive(filename, method):
+    """
+    open an archive of the given type (see extract_files).
+    """
+    if method == "headerless":
+        return headers.Headerless(filename)
+    if method == "bps":
+        return bps.Patched(filename)
+    return zipfile.ZipFile(filename)
+
+
+def extract_member(archive, entry, dest):
+    """
+    decompress entry to dest, and return the sha256 hex value of the
+    decompressed data (computed in the same pass) and its size. If dest
+    is None, the entry is only hashed.
+    """
+    h = hashlib.sha256()
+    if dest is None:
+        with METRICS.phase("verify member") as phase:
+            with archive.open(entry) as source:
+                for b in iter(lambda: source.read(128 * 1024), b''):
+                    h.update(b)
+                    phase.bytes += len(b)
+        return h.hexdigest(), phase.bytes
+    # copy file (taken from zipfile's extract)
+    with METRICS.phase("extract", "bytes_written") as phase:
+        source = archive.open(entry)
+        target = open(dest, "wb")
+        with source, target:
+            for b in iter(lambda: source.read(128 * 1024), b''):
+                h.update(b)
+                target.write(b)
+                phase.bytes += len(b)
+    count("members_extracted")
+    return h.hexdigest(), phase.bytes
+
+
+def plan_copy(source, dest, original, sha256):
+    """
+    add the copy of source to dest to the plan (see --plan).
+    """
+    strategy, source = resolve_strategy(source, dest, original)
+    PLAN.append((source, "", dest, strategy, sha256))
+
+
+def write_plan(plan, plan_file):
+    """
+    write the actions of a plan as a tab-separated table: source,
+    archive member, destination, strategy and expected sha256.
+    """
+    with open(plan_file, "w", encoding="utf-8") as output:
+        print("source", "member", "destination", "strategy", "sha256",
+              sep="\t", file=output)
+        for source, member, dest, strategy, sha256 in plan:
+            if source:
+                source = os.path.abspath(source)
+            print(source, member, os.path.abspath(dest), strategy, sha256,
+                  sep="\t", file=output)
+
+
+def read_plan(plan_file):
+    """
+    yield the actions of a plan (see write_plan).
+    """
+    with open(plan_file, "r", encoding="utf-8") as plan:
+        next(plan)  # header
+        for line in plan:
+            line = line.rstrip("\r\n")
+            if line:
+                yield tuple(line.split("\t"))
+
+
+def execute_plan(plan_file):
+    """
+    carry out the actions of a plan, with concurrent writers (see
+    --write_jobs), and return the statistics of the writing stage.
+
+    Actions extracting entries of the same archive are done by the
+    same writer (the archive is opened once). An action starts after
+    the actions writing its source or destination are finished, so
+    that files are copied (or hardlinked) only when complete.
 
-                basename = os.path.basename(member)
-                # skip directories
-                if not basename:
+    Sources are verified against the plan before being copied (see
+    verify_source), except files written by the plan itself.
+    """
+    writing = pipeline.Stage("write", ARGS.write_jobs, ARGS.queue_size)
+    writer = pipeline.WorkerPool(writing)
+    actions = []
+    verified = set()  # sources verified, or written by the plan
+
+    def submit(actions):
+        if actions:
+            writer.wait([source for source, _, _, _, _ in actions])
+            writer.submit([dest for _, _, dest, _, _ in actions],
+                          METRICS.profiled(execute_actions), actions,
+                          verified)
+
+    try:
+        for action in read_plan(plan_file):
+            source, member, dest, strategy, sha256 = action
+            verified.add(dest)
+            if (strategy != "extract" or not actions or
+                    actions[0][0] != source):
+                submit(actions)
+                actions = []
+            actions.append(action)
+            if strategy != "extract":
+                submit(actions)
+                actions = []
+        submit(actions)
+    finally:
+        writer.close()
+    return writing
+
+
+def execute_actions(actions, verified=None):
+    """
+    carry out actions of a plan (extractions are from a single
+    archive). Copied sources are verified, unless listed in verified
+    (see verify_source).
+    """
+    for source, member, dest, strategy, sha256 in actions:
+        OUTPUT_TREE.makedirs(os.path.dirname(os.path.abspath(dest)))
+        count("plan_actions")
+        if strategy == "empty":
+            write_empty_file(dest)
+        elif strategy not in EXTRACT_STRATEGIES.values():
+            if not (ARGS.skip_existing and OUTPUT_TREE.exists(dest)):
+                verify_source(source, sha256, verified)
+            copy_file(source, dest, dest, strategy)
+    extractions = [action for action in actions
+                   if action[3] in EXTRACT_STRATEGIES.values()]
+    if extractions:
+        method = EXTRACT_METHODS[extractions[0][3]]
+        with open_archive(extractions[0][0], method) as archive:
+            for source, member, dest, strategy, sha256 in extractions:
+                if (ARGS.skip_existing and OUTPUT_TREE.exists(dest)):
                     continue
+                digest, size = extract_member(archive, member, dest)
+                if digest != sha256:
+                    os.remove(dest)
+                    raise ValueError("{} ({}) does not match the plan, "
+                                     "make a new plan".format(source,
+                                                              member))
+                OUTPUT_TREE.add(dest, size)
 
-                # copy file (taken from zipfile's extract)
-                source = zip_file.open(member)
-                target = open(dest, "wb")
-                with source, target:
-                    shutil.copyfileobj(source, target)
+
+def verify_source(source, sha256, verified=None):
+    """
+    raise ValueError if a source of a plan does not match the sha256
+    value of the plan (the file changed since the plan was made).
+    Unchanged files are not read again if the hash cache has their
+    sha256 value (see --cache). Verified sources are added to
+    verified.
+    """
+    if verified is not None and source in verified:
+        return
+    st = os.stat(source)
+    record = dict.fromkeys(hash_cache.FIELDS)
+    if HASH_CACHE:
+        st, record = HASH_CACHE.lookup(source, st)
+    digest = record["sha256"]
+    if not digest:
+        digest = file_sha256(source)
+        if HASH_CACHE:
+            HASH_CACHE.store(source, st, {"sha256": digest})
+    if digest != sha256:
+        raise ValueError("{} does not match the plan, make a new "
+                         "plan".format(source))
+    count("plan_sources_verified")
+    if verified is not None:
+        verified.add(source)
 
 
 def parse_database(target_database, drop_initial_directory):
     """
-    store hash values and filenames in a database.
+    store hash values and filenames in a database (see smdb.py, a
+    compiled index is used when available).
+
+    Also return the set of file sizes listed in the database (or None
+    if the size column (6th column) is missing in at least one record).
+    """
+    db = smdb.Database(smdb.open_index(target_database),
+                       drop_initial_directory)
+    return db, db.number_of_entries, db.sizes
+
+
+def parse_manifest(manifest):
+    """
+    return (database, output folder, missing files) tuples listed in
+    a manifest file (tab-separated, lines starting with # are
+    comments).
+    """
+    packs = []
+    with open(manifest, "r") as lines:
+        for number, line in enumerate(lines, 1):
+            line = line.rstrip("\r\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            columns = line.split("\t")
+            if len(columns) < 2:
+                sys.exit("{}, line {}: a database and an output folder "
+                         "(tab-separated) are required".format(manifest,
+                                                               number))
+            missing_files = columns[2] if len(columns) > 2 else None
+            packs.append((columns[0], columns[1], missing_files or None))
+    return packs
+
+
+def load_pack(target_database, output_folder, missing_files,
+              drop_initial_directory):
+    """
+    parse a database, and return a dictionary describing the pack to
+    build.
+    """
+    with METRICS.phase("load database"):
+        db, number_of_entries, sizes = parse_database(target_database,
+                                                      drop_initial_directory)
+    return {
+        'database': target_database,
+        'output_folder': output_folder,
+        'missing_files': missing_files,
+        'db': db,
+        'number_of_entries': number_of_entries,
+        'sizes': sizes,
+        'journal': None
+    }
+
+
+def resume_pack(pack):
+    """
+    mark the entries placed by a previous run as found (if their
+    destination file is still complete), and return the sources done
+    during that run (see journal.py).
+    """
+    db = pack['db']
+    complete, incomplete_sources = pack['journal'].complete_placements(
+        OUTPUT_TREE.getsize)
+    if complete:
+        for entry in range(db.number_of_entries):
+            if db.filename(entry) in complete:
+                db.mark_found(entry)
+    return pack['journal'].done_sources(incomplete_sources)
+
+
+def is_done(filename, done_sources):
+    """
+    true if filename was done during a previous run, and has not
+    changed since.
     """
-    db = defaultdict(list)  # missing key's default value is an empty list
-    number_of_entries = 0
-    with open(target_database, "r") as target_database:
-        for line in target_database:
-            hash_sha256, filename, _, _, hash_crc = line.strip().split("\t")[0:5]
-            number_of_entries += 1
-            if drop_initial_directory:
-                first_level, filename = filename.split("/", 1)
-            filename = os.path.normpath(filename)
-            db[hash_sha256].append(filename)
-            db[hash_crc].append(filename)
-    return db, number_of_entries
+    done = done_sources.get(os.path.abspath(filename))
+    if done is None:
+        return False
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return False
+    return done == (st.st_size, st.st_mtime_ns)
 
 
 def print_progress(current, total, end):
@@ -240,97 +794,468 @@ def print_function(text, end, file=sys.stdout, flush=True):
     print(text, end=end, file=file, flush=flush)
 
 
-def parse_folder(source_folder, db, output_folder):
+def walk_files(source_folder):
     """
-    read each file, produce a hash value and place it in the directory tree.
+    yield the files of the source folder, in walking order (except the
+    hash cache and journals).
     """
-    i = 0
-    total = len([os.path.join(dp, f) for dp, dn, fn in
-                 os.walk(os.path.expanduser(source_folder)) for f in fn])
     for dirpath, dirnames, filenames in os.walk(source_folder):
-        if filenames:
-            for f in filenames:
-                filename = os.path.join(os.path.normpath(dirpath),
-                                        os.path.normpath(f))
-                absolute_filename = u'\\\\?\\' + os.path.abspath(filename)
-                try:
-                    hashes = get_hashes(filename)
-                except FileNotFoundError:
-                    hashes = get_hashes(absolute_filename)
-
-                for h, info in hashes.items():
-                    if h in db:
-                        # we have a hit
-                        loop = 0
-                        for entry in db[h]:
-                            loop += 1
-                            new_path = os.path.join(output_folder,
-                                                    os.path.dirname(entry))
-                            # create directory structure if need be
-                            if not os.path.exists(new_path):
-                                os.makedirs(new_path, exist_ok=True)
-                            new_file = os.path.join(output_folder, entry)
-                            if loop == 1:
-                                original = new_file
-                            if (not ARGS.skip_existing or not
-                                    os.path.exists(new_file)):
-                                if info['archive']:
-                                    # extract file from archive to directory
-                                    extract_file(info['filename'],
-                                                 info['archive']['entry'],
-                                                 info['archive']['type'],
-                                                 new_file)
-                                else:
-                                    # copy the file to the new directory
-                                    copy_file(info['filename'],
-                                              new_file,
-                                              original)
-                        # remove the hit from the database
-                        del db[h]
-
-                i += 1
+        for f in filenames:
+            filename = os.path.join(os.path.normpath(dirpath),
+                                    os.path.normpath(f))
+            if not (hash_cache.is_cache_file(filename, HASH_CACHE) or
+                    journal.is_journal_file(filename)):
+                yield filename
+
+
+def count_files(source_folder, done_sources=None):
+    """
+    return the number of files to process (names only, files are not
+    read), for the total of the progress line.
+    """
+    return sum(1 for filename in walk_files(source_folder)
+               if not (done_sources and is_done(filename, done_sources)))
+
+
+def list_files(source_folder, done_sources=None, stage=None):
+    """
+    yield files to process, in walking order (scanner stage). Files
+    listed in done_sources (see resume_pack) are skipped.
+    """
+    for filename in walk_files(source_folder):
+        if done_sources and is_done(filename, done_sources):
+            count("resumed_sources")
+            continue
+        if stage:
+            stage.count()
+        if PROGRESS:
+            PROGRESS.add(filename)
+        yield filename
+    if PROGRESS:
+        PROGRESS.scanned()
+
+
+def hash_file(filename, **options):
+    """
+    get_hashes, with a fallback for long Windows paths.
+    """
+    try:
+        return get_hashes(filename, **options)
+    except FileNotFoundError:
+        absolute_filename = u'\\\\?\\' + os.path.abspath(filename)
+        return get_hashes(absolute_filename, **options)
+
+
+def count_output_calls():
+    """
+    add the system calls made on the output folders (see
+    output_tree.py) to the run statistics, prefixed with "output_"
+    (stat counts the source files).
+    """
+    for key, value in OUTPUT_TREE.system_calls.items():
+        count("output_" + key, value)
+
+
+def count(key, value=1):
+    """
+    increment a run statistic (thread-safe).
+    """
+    METRICS.count(key, value)
+
+
+def parse_folder(source_folder, packs, sizes=None, crcs=None,
+                 hash_archives=True, done_sources=None):
+    """
+    read each file, produce a hash value and place it in the directory
+    tree of each pack (see load_pack), and return the statistics of
+    each stage.
+
+    If sizes is a set of file sizes, files of other sizes are not
+    hashed (but zip archives are still searched for matching entries).
+    If crcs is a set of CRC32 values, files whose CRC32 is not in
+    that set are not hashed with SHA256. See get_hashes for
+    hash_archives.
+
+    Work is split into three stages connected by bounded queues (see
+    pipeline.py and --queue_size): a scanner walks the source folder,
+    files are hashed concurrently (see --jobs), and files are copied
+    concurrently (see --write_jobs), so that reading sources and
+    writing destinations overlap. Hash values are still processed in
+    walking order, so that the first file matching a hash value is
+    always the one placed in the directory tree.
+
+    Files listed in done_sources (see resume_pack) are skipped.
+
+    The scanner stays at most --queue_size files ahead, so files are
+    counted first (a walk reading names only), for the total of the
+    progress line.
+    """
+    i = 0
+    source_folder = os.path.expanduser(source_folder)
+    total = count_files(source_folder, done_sources)
+    if PROGRESS:
+        PROGRESS.phase("build", total)
+    scanning = pipeline.Stage("scan", 1, ARGS.queue_size)
+    hashing = pipeline.Stage("hash", ARGS.jobs, ARGS.queue_size)
+    writing = pipeline.Stage("write", ARGS.write_jobs, ARGS.queue_size)
+    files = list_files(source_folder, done_sources, scanning)
+    journals = [pack['journal'] for pack in packs if pack['journal']]
+    writer = pipeline.WorkerPool(writing)
+    try:
+        for filename, hashes in pipeline.ordered_map(METRICS.profiled(
+                functools.partial(hash_file, sizes=sizes, crcs=crcs,
+                                  hash_archives=hash_archives,
+                                  strip_headers=ARGS.headers,
+                                  patches=PATCHES)),
+                files, hashing):
+            copies = []
+            extractions = []
+            with METRICS.phase("place"):
+                for pack in packs:
+                    pack_copies, pack_extractions = place_hashes(
+                        hashes, pack['db'], pack['output_folder'],
+                        pack['journal'], writer)
+                    copies += pack_copies
+                    extractions += pack_extractions
+            if PLAN is not None:
+                place_files(copies, extractions)
+            else:
+                writer.submit([new_file for _, _, destinations, _ in copies
+                               for _, new_file in destinations] +
+                              [new_file for extraction in extractions
+                               for _, new_file in extraction[3]],
+                              METRICS.profiled(place_files), copies,
+                              extractions, filename, journals)
+
+            i += 1
+            if PROGRESS:
+                PROGRESS.done(filename)
+            else:
                 print_progress(i, total, END_LINE)
+    finally:
+        writer.close()
+    if PROGRESS:
+        PROGRESS.end_phase()
+    elif not ARGS.new_line:
+        print_progress(i, total, "\n")
+    return scanning, hashing, writing
+
+
+def place_hashes(hashes, db, output_folder, placements=None, writer=None):
+    """
+    place the file (or archive entries) matching database entries in
+    the directory tree, and mark these entries as found. Complete
+    destination files are recorded in the placements journal, if any.
+
+    Archive entries are found by CRC32, and are verified against the
+    sha256 values of the database during extraction (see
+    extract_entries), so they are marked as found once extracted. An
+    entry being extracted by the writer is still pending: the
+    extraction is waited for, so that entries are claimed in walking
+    order (a rejected entry remains available for this file).
+
+    Files are not copied or extracted here: return a list of (source,
+    sha256, [(filename, destination)], placements) copies and a list
+    of extractions (see extract_entries), see place_files.
+    """
+    copies = []
+    extractions = {}  # method -> [(entry, [(destination, sha256)])]
+    archive_entries = {}  # method -> [(entry, destination)]
+    for h, info in hashes.items():
+        entries = db.pending(h)
+        if entries and writer:
+            writer.wait([os.path.join(output_folder, db.filename(entry))
+                         for entry in entries])
+            entries = db.pending(h)
+        if entries:
+            # we have a hit
+            destinations = []
+            for entry in entries:
+                filename = db.filename(entry)
+                new_path = os.path.join(output_folder,
+                                        os.path.dirname(filename))
+                # create directory structure if need be
+                if PLAN is None:
+                    OUTPUT_TREE.makedirs(new_path)
+                destinations.append(os.path.join(output_folder, filename))
+            if info['archive']:
+                # extract file from archive to directories
+                # (below, all entries at once)
+                archive = info['filename']
+                method = info['archive']['type']
+                expected = [db.sha256(entry) for entry in entries]
+                extractions.setdefault(method, []).append(
+                    (info['archive']['entry'],
+                     list(zip(destinations, expected))))
+                archive_entries.setdefault(method, []).extend(
+                    zip(entries, destinations))
+                continue
+            for entry in entries:
+                db.mark_found(entry)
+            copies.append((info['filename'], h,
+                           [(db.filename(entry), new_file) for entry, new_file
+                            in zip(entries, destinations)],
+                           placements))
+
+    # a file is a zip archive, or a ROM placed without its header
+    # and/or patched
+    return copies, [(archive, method, extractions[method],
+                     archive_entries[method], db, placements)
+                    for method in sorted(extractions)]
+
+
+def extract_entries(archive, method, extractions, archive_entries, db,
+                    placements=None):
+    """
+    extract entries of an archive (see extract_files), and mark the
+    verified ones as found. archive_entries is the list of (database
+    entry, destination) tuples of the extractions.
+    """
+    placed = extract_files(archive, method, extractions)
+    # only verified entries are found
+    for entry, new_file in archive_entries:
+        if new_file in placed:
+            db.mark_found(entry)
+            if placements:
+                placements.placed(archive, db.filename(entry),
+                                  placed[new_file])
+
+
+def place_files(copies, extractions=(), source=None, journals=()):
+    """
+    extract archive entries and copy files to their destinations (see
+    place_hashes), or add them to the plan (see --plan), then record
+    that source is done in the journals.
+
+    Placements of copies are recorded with the size of the source (the
+    copies are not read again from the output folder).
+    """
+    for extraction in extractions:
+        extract_entries(*extraction)
+    st = None
+    if source and journals:
+        try:
+            st = os.stat(source)
+        except OSError:
+            pass  # long Windows path, not journaled
+    for filename, sha256, destinations, placements in copies:
+        original = destinations[0][1]
+        for entry_filename, new_file in destinations:
+            if ARGS.skip_existing and OUTPUT_TREE.exists(new_file):
+                pass
+            elif PLAN is not None:
+                plan_copy(filename, new_file, original, sha256)
+            else:
+                # copy the file to the new directory
+                copy_file(filename, new_file, original)
+            if placements and st:
+                placements.placed(filename, entry_filename, st.st_size)
+    if st:
+        for placements in journals:
+            placements.done(source, st)
+
+
+def report_missing(db, output_folder, missing_files):
+    """
+    create missing empty files, list missing files, and return the
+    number of entries found.
+    """
+    # Empty files are created rather than searched for. For reference,
+    # an empty file will always have the following hashes:
+    # SHA256: e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855
+    # SHA1:   da39a3ee5e6b4b0d3255bfef95601890afd80709
+    # MD5SUM: d41d8cd98f00b204e9800998ecf8427e
+    # CRC32:  00000000
+    missing = []
+    for entry in db.missing():
+        if db.sha256(entry) == EMPTY_SHA256:
+            empty_file = os.path.join(output_folder, db.filename(entry))
+            if PLAN is not None:
+                PLAN.append(("", "", empty_file, "empty", EMPTY_SHA256))
+            else:
+                write_empty_file(empty_file)
+            db.mark_found(entry)
+        else:
+            missing.append(entry)
+
+    # list each missing sha256 value once (with the name of its first
+    # entry), even if several entries share that value
+    missing_hashes = {}
+    for entry in missing:
+        missing_hashes.setdefault(db.sha256(entry), db.filename(entry))
+    missing_file_list = [(os.path.basename(filename), h)
+                         for h, filename in missing_hashes.items()]
+
+    if missing_file_list:
+        missing_file_list.sort()
+        if missing_files:
+            with open(missing_files, "w") as missing_files:
+                for missing_file, entry in missing_file_list:
+                    print(missing_file, entry, sep="\t", file=missing_files)
     else:
-        if not ARGS.new_line:
-            print_progress(i, total, "\n")
+        print("no missing file")
+
+    return db.number_of_entries - len(missing)
 
 
-def get_hashes(filename):
+def write_report(packs, report_file):
+    """
+    write the status of each database entry, as a JSON list or as a
+    tab-separated table.
+    """
+    records = [(pack['database'], entry + 1,
+                "found" if pack['db'].found[entry] else "missing",
+                pack['db'].sha256(entry), pack['db'].filename(entry))
+               for pack in packs
+               for entry in range(pack['db'].number_of_entries)]
+    with open(report_file, "w") as report:
+        if report_file.lower().endswith(".json"):
+            json.dump([dict(zip(("database", "line", "status", "sha256",
+                                 "filename"), record))
+                       for record in records], report, indent=1)
+            print(file=report)
+        else:
+            print("database", "line", "status", "sha256", "filename",
+                  sep="\t", file=report)
+            for record in records:
+                print(*record, sep="\t", file=report)
+
+
+def get_hashes(filename, sizes=None, crcs=None, hash_archives=True,
+               strip_headers=False, patches=None):
     """
     return dictionary of hashes containing:
-        - sha256 hash of the file itself
+        - sha256 hash of the file itself (skipped if sizes is a set
+          of file sizes that does not contain the size of the file,
+          or if crcs is a set of CRC32 values that does not contain
+          the CRC32 of the file)
         - additional hashes if the file is a compressed archive
+        - sha256 hash of the file without its header, if strip_headers
+          is true and the file has a known header (see headers.py)
+        - CRC32 hashes of the files made by the patches of patches
+          (see bps.PatchIndex) for the file, if any
+
+    The central directory of a zip archive is read first. The archive
+    itself is hashed only if hash_archives is true, or if its size is
+    in sizes.
     """
-    hashes = {}
-    h = hashlib.sha256()
+    st = os.stat(filename)
+    count("stat")
+    record = dict.fromkeys(hash_cache.FIELDS)
+    computed = {}
+
+    # hash values computed during a previous run
+    if HASH_CACHE:
+        st, record = HASH_CACHE.lookup(filename, st)
+
+    # if this is a zipfile, extract CRCs from header
+    members = record["members"]
+    if members is None:
+        members = computed["members"] = get_zip_members(filename)
+
+    if members:
+        hash_itself = hash_archives or (sizes is not None and
+                                        st.st_size in sizes)
+    else:
+        hash_itself = sizes is None or st.st_size in sizes
+
+    # hash the file without its header, and the file itself in the
+    # same pass (the header size and headerless hash are cached)
+    sha256 = record["sha256"]
+    header = headerless = None
+    if strip_headers and not members:
+        header = record["header"]
+        if header is None:
+            header = computed["header"] = headers.header_size(filename,
+                                                              st.st_size)
+        headerless = record["headerless_sha256"]
+        if (header and not headerless and
+                (sizes is None or st.st_size - header in sizes)):
+            file_hash, headerless = file_sha256_headerless(filename, header)
+            computed["headerless_sha256"] = headerless
+            if hash_itself and not sha256:
+                sha256 = computed["sha256"] = file_hash
+
+    # the CRC32 value of the file finds the patches made for it
+    patched = []
+    if patches is not None and not members and st.st_size in patches.sizes:
+        crc = record["crc32"]
+        if not crc:
+            crc = computed["crc32"] = file_crc32(filename)
+        patched = patches.find(st.st_size, crc)
 
     # hash the file itself
-    with open(filename, "rb", buffering=0) as f:
-        # use a small buffer to compute hash to
-        # avoid memory overload
-        for b in iter(lambda: f.read(128 * 1024), b''):
-            h.update(b)
+    if hash_itself and not sha256:
+        if crcs is not None:
+            # cheap CRC32 first, SHA256 only for possible matches
+            crc = record["crc32"] or computed.get("crc32")
+            if not crc:
+                crc = computed["crc32"] = file_crc32(filename)
+            if crc in crcs:
+                sha256 = computed["sha256"] = file_sha256(filename)
+                count("crc_first_confirmed")
+            else:
+                count("crc_first_rejected")
+                count("crc_first_rejected_bytes", st.st_size)
+        else:
+            sha256 = computed["sha256"] = file_sha256(filename)
+    if not hash_itself:
+        sha256 = None
 
-    # add file hash to dict
-    hashes[h.hexdigest()] = {
-        'filename': filename,
-        'archive': None
-    }
+    if HASH_CACHE and computed:
+        HASH_CACHE.store(filename, st, computed)
 
-    # if this is a zipfile, extract CRCs from header
-    if zipfile.is_zipfile(filename):
+    return make_hashes(filename, sha256, members, header, headerless,
+                       patched)
+
+
+def file_sha256(filename):
+    """
+    return the sha256 hex value of a file.
+    """
+    with METRICS.phase("sha256", "bytes_read") as phase:
+        sha256 = hashing.hash_file(filename, ("sha256",), phase)["sha256"]
+    count("files_hashed")
+    return sha256
+
+
+def file_sha256_headerless(filename, header):
+    """
+    return the sha256 hex values of a file, and of the file without
+    its first header bytes (computed in the same pass).
+    """
+    with METRICS.phase("sha256", "bytes_read") as phase:
+        values = hashing.hash_file(filename, ("sha256",), phase, header)
+    count("files_hashed")
+    count("headers_hashed")
+    return values["sha256"], values["headerless"]["sha256"]
+
+
+def file_crc32(filename):
+    """
+    return the crc32 hex value of a file.
+    """
+    with METRICS.phase("crc32", "bytes_read") as phase:
+        return hashing.hash_file(filename, ("crc32",), phase)["crc32"]
+
+
+def get_zip_members(filename):
+    """
+    return the [name, crc32, size] list of the members of a zip
+    archive (empty list if filename is not a zip archive).
+    """
+    members = []
+    count("zip_inspections")
+    # open once, only the end of the file (central directory) is read
+    with METRICS.phase("zip inspection"), open(filename, "rb") as f:
+        if not zipfile.is_zipfile(f):
+            return members
         try:
-            with zipfile.ZipFile(filename, 'r') as z:
+            with zipfile.ZipFile(f, 'r') as z:
                 for info in z.infolist():
-                    # add archive entry hash to dict
                     crc_formatted_hex = '{0:08x}'.format(info.CRC & 0xffffffff)
-                    hashes[crc_formatted_hex] = {
-                        'filename': filename,
-                        'archive': {
-                            'entry': info.filename,
-                            'type': 'zip'
-                        }
-                    }
+                    members.append([info.filename, crc_formatted_hex,
+                                    info.file_size])
         except (OSError, UnicodeDecodeError, zipfile.BadZipFile):
             # Possible normal file containing a zip magic number?
             print('**** ERROR ****')
@@ -340,6 +1265,58 @@ def get_hashes(filename):
                   ' ignore this error.')
             print('***************')
             pass
+    return members
+
+
+def make_hashes(filename, sha256, members, header=None, headerless=None,
+                patched=()):
+    """
+    build the dictionary returned by get_hashes from the hash of the
+    file (None if not computed), the [name, crc32, size] list of its
+    zip members, the hash of the file without its header of header
+    bytes (None if not computed), and the patches made for the file
+    (see bps.Patch).
+    """
+    hashes = {}
+
+    # add file hash to dict
+    if sha256:
+        hashes[sha256] = {
+            'filename': filename,
+            'archive': None
+        }
+
+    # add archive entry hashes to dict
+    for entry, crc, _ in members:
+        hashes[crc] = {
+            'filename': filename,
+            'archive': {
+                'entry': entry,
+                'type': 'zip'
+            }
+        }
+
+    # add the file without its header, extracted like an archive entry
+    # (see headers.Headerless)
+    if headerless:
+        hashes[headerless] = {
+            'filename': filename,
+            'archive': {
+                'entry': str(header),
+                'type': 'headerless'
+            }
+        }
+
+    # add the targets of the patches, extracted like archive entries
+    # (see bps.Patched)
+    for patch in patched:
+        hashes[patch.target_crc] = {
+            'filename': filename,
+            'archive': {
+                'entry': patch.filename,
+                'type': 'bps'
+            }
+        }
 
     return hashes
 
@@ -351,63 +1328,175 @@ def get_hashes(filename):
 # *********************************************************************#
 
 if __name__ == '__main__':
+    METRICS.configure(ARGS)
+    PROGRESS = progress.open_progress(ARGS)
+
+    if ARGS.execute_file:
+        HASH_CACHE = hash_cache.open_cache(ARGS.cache_file,
+                                           ARGS.no_cache,
+                                           ARGS.rebuild_cache)
+        if PROGRESS:
+            PROGRESS.phase("execute")
+        WRITING = execute_plan(ARGS.execute_file)
+        if HASH_CACHE:
+            HASH_CACHE.close()
+            print(HASH_CACHE.summary(), file=sys.stdout)
+        if ARGS.stats:
+            print(WRITING.summary(), file=sys.stdout)
+        print("plan: {} actions".format(METRICS.counters["plan_actions"]),
+              file=sys.stdout)
+        if PROGRESS:
+            PROGRESS.summary(actions=METRICS.counters["plan_actions"])
+        count_output_calls()
+        METRICS.finish(ARGS)
+        sys.exit(0)
+
+    if ARGS.plan_file:
+        PLAN = []
+
     SOURCE_FOLDER = ARGS.source_folder
-    TARGET_DATABASE = ARGS.target_database
-    OUTPUT_FOLDER = ARGS.output_folder
-    MISSING_FILES = ARGS.missing_files
     END_LINE = "\n" if ARGS.new_line else "\r"
     DROP_INITIAL_DIRECTORY = ARGS.drop_initial_directory
 
-    DATABASE, NUMBER_OF_ENTRIES = parse_database(TARGET_DATABASE,
-                                                 DROP_INITIAL_DIRECTORY)
-    parse_folder(SOURCE_FOLDER, DATABASE, OUTPUT_FOLDER)
+    PACK_LIST = list(zip(ARGS.target_database, ARGS.output_folder,
+                         ARGS.missing_files + [None] * len(
+                             ARGS.target_database)))
+    if ARGS.manifest:
+        PACK_LIST += parse_manifest(ARGS.manifest)
 
-    # Observed files will have either their SHA256 or their CRC32 entry
-    # deleted (or both) from the database. For missing files, both entries
-    # will still be present. If the hash for an empty file exists as both
-    # SHA256 and CRC32, then it is missing and will be created below.
-    #
-    # For reference, an empty file will always have the following hashes:
-    # SHA256: e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855
-    # SHA1:   da39a3ee5e6b4b0d3255bfef95601890afd80709
-    # MD5SUM: d41d8cd98f00b204e9800998ecf8427e
-    # CRC32:  00000000
-    if (('e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
-            in DATABASE) and ('00000000' in DATABASE)):
-        for file in DATABASE['00000000']:
-            empty_file = os.path.join(OUTPUT_FOLDER, file)
-            write_empty_file(empty_file)
+    HASH_CACHE = hash_cache.open_cache(ARGS.cache_file,
+                                       ARGS.no_cache,
+                                       ARGS.rebuild_cache)
 
-    # Since missing files will be in the database twice as explained above,
-    # only keep the SHA256 entry (64 char length hash) when listing out the
-    # missing files. This will prevent missing files from being counted more
-    # than once.
-    file_counts = Counter([str(i) for i in DATABASE.values()])
-    duplicate_files = set([str(i) for i in file_counts if file_counts[i] == 2])
+    if ARGS.patch_folder:
+        PATCHES = bps.PatchIndex(os.path.abspath(os.path.expanduser(
+            ARGS.patch_folder)))
+        for error in PATCHES.errors:
+            print("skipped patch: {}".format(error), file=sys.stderr)
 
-    missing_file_list = [(os.path.basename(DATABASE[entry][0]), entry)
-                         for entry in DATABASE
-                         if (str(DATABASE[entry]) in duplicate_files
-                         and len(entry) == 64)]
+    if PROGRESS:
+        PROGRESS.phase("load")
+    PACKS = [load_pack(target_database, output_folder, missing_files,
+                       DROP_INITIAL_DIRECTORY)
+             for target_database, output_folder, missing_files in PACK_LIST]
 
-    missing_entry_count = sum([len(DATABASE[missing_file[1]])
-                               for missing_file in missing_file_list])
+    # placements are journaled, so that an interrupted build can be
+    # resumed (see --resume)
+    DONE_SOURCES = None
+    for pack in PACKS:
+        # existing files and directories are read once
+        with METRICS.phase("scan output"):
+            OUTPUT_TREE.scan(pack['output_folder'])
+        if PLAN is not None:
+            continue  # the output folder is not modified
+        pack['journal'] = journal.Journal(pack['output_folder'], ARGS.resume)
+        if ARGS.resume:
+            done_sources = resume_pack(pack)
+            if DONE_SOURCES is None:
+                DONE_SOURCES = done_sources
+            else:
+                # a source is skipped only if it is done for all packs
+                DONE_SOURCES = {source: stat for source, stat
+                                in DONE_SOURCES.items()
+                                if done_sources.get(source) == stat}
 
-    FOUND_ENTRIES = NUMBER_OF_ENTRIES - missing_entry_count
+    # each source file is hashed once for all packs
+    SIZES = None
+    if all(pack['sizes'] is not None for pack in PACKS):
+        SIZES = smdb.Union(pack['sizes'] for pack in PACKS)
+    CRCS = None
+    if ARGS.crc_first:
+        CRCS = smdb.Union(pack['db'].crcs for pack in PACKS)
+    # without file sizes, zip archives listed in the database can
+    # only be identified by hashing all archives
+    HASH_ARCHIVES = ARGS.hash_archives or any(
+        pack['sizes'] is None and pack['db'].lists_zip for pack in PACKS)
+    STAGES = parse_folder(SOURCE_FOLDER, PACKS, SIZES, CRCS, HASH_ARCHIVES,
+                          DONE_SOURCES)
+    for stage in STAGES:
+        if ARGS.stats and (PLAN is None or stage.items):
+            print(stage.summary(), file=sys.stdout)
 
-    if missing_file_list:
-        missing_file_list.sort()
-        if MISSING_FILES:
-            with open(MISSING_FILES, "w") as missing_files:
-                for missing_file, entry in missing_file_list:
-                    print(missing_file, entry, sep="\t", file=missing_files)
-    else:
-        print("no missing file")
+    if HASH_CACHE:
+        HASH_CACHE.close()
+        print(HASH_CACHE.summary(), file=sys.stdout)
+
+    if (METRICS.counters["zip_members_confirmed"] or
+            METRICS.counters["zip_members_rejected"]):
+        print("zip members: {} confirmed, {} rejected (sha256 "
+              "mismatch)".format(METRICS.counters["zip_members_confirmed"],
+                                 METRICS.counters["zip_members_rejected"]),
+              file=sys.stdout)
+
+    if ARGS.headers:
+        print("headers: {} files hashed with and without header, {} "
+              "placed without header".format(
+                  METRICS.counters["headers_hashed"],
+                  METRICS.counters["headerless_members_confirmed"]),
+              file=sys.stdout)
+
+    if PATCHES is not None:
+        print("patches: {} patches, {} files patched, {} rejected (sha256 "
+              "mismatch)".format(len(PATCHES),
+                                 METRICS.counters["bps_members_confirmed"],
+                                 METRICS.counters["bps_members_rejected"]),
+              file=sys.stdout)
+
+    if ARGS.file_strategy in ("reflink", "clone") and PLAN is None:
+        print("{}: {} files reflinked, {} copied in kernel, {} copied".format(
+            ARGS.file_strategy, METRICS.counters["reflinked"],
+            METRICS.counters["copied_in_kernel"],
+            METRICS.counters["copied"]), file=sys.stdout)
+
+    if ARGS.resume:
+        print("resume: {} source files skipped".format(
+            METRICS.counters["resumed_sources"]), file=sys.stdout)
+
+    if ARGS.crc_first:
+        print("crc32 first: {} files confirmed with sha256, {} files "
+              "({} bytes) rejected without sha256".format(
+                  METRICS.counters["crc_first_confirmed"],
+                  METRICS.counters["crc_first_rejected"],
+                  METRICS.counters["crc_first_rejected_bytes"]),
+              file=sys.stdout)
+
+    if PROGRESS:
+        PROGRESS.phase("report")
+    for pack in PACKS:
+        if len(PACKS) > 1:
+            print("{} -> {}".format(pack['database'], pack['output_folder']),
+                  file=sys.stdout)
+        with METRICS.phase("report missing"):
+            FOUND_ENTRIES = report_missing(pack['db'],
+                                           pack['output_folder'],
+                                           pack['missing_files'])
+        NUMBER_OF_ENTRIES = pack['number_of_entries']
+        COVERAGE = round(100.0 * FOUND_ENTRIES / NUMBER_OF_ENTRIES, 2)
+        print('coverage: {}/{} ({}%)'.format(FOUND_ENTRIES,
+                                             NUMBER_OF_ENTRIES,
+                                             COVERAGE),
+              file=sys.stdout)
+        if PROGRESS:
+            PROGRESS.summary(database=pack['database'],
+                             output_folder=pack['output_folder'],
+                             entries=NUMBER_OF_ENTRIES,
+                             found=FOUND_ENTRIES,
+                             missing=NUMBER_OF_ENTRIES - FOUND_ENTRIES,
+                             coverage=COVERAGE)
+
+    if ARGS.report_file:
+        write_report(PACKS, ARGS.report_file)
+
+    if PLAN is not None:
+        write_plan(PLAN, ARGS.plan_file)
+        print("plan: {} actions".format(len(PLAN)), file=sys.stdout)
+
+    # the build is complete, the journals are no longer needed
+    for pack in PACKS:
+        if pack['journal']:
+            pack['journal'].close(remove=True)
 
-    COVERAGE = round(100.0 * FOUND_ENTRIES / NUMBER_OF_ENTRIES, 2)
-    print('coverage: {}/{} ({}%)'.format(FOUND_ENTRIES,
-                                         NUMBER_OF_ENTRIES,
-                                         COVERAGE),
-          file=sys.stdout)
+    count_output_calls()
+    METRICS.finish(ARGS)
 
     sys.exit(0)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+persistent cache of hash values, shared by the build, parse and verify
+scripts.
+"""
+import os
+import sys
+import json
+import sqlite3
+import threading
+
+
+__author__ = "aquaman"
+__date__ = "2026/10/18"
+__version__ = "$Revision: 1.2"
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Constants                                 #
+#                                                                      #
+# *********************************************************************#
+
+CACHE_FILENAME = "hash_cache.sqlite"
+SCHEMA_VERSION = 2
+COMMIT_INTERVAL = 1000  # number of stores between two commits
+FIELDS = ("sha256", "sha1", "md5", "crc32", "members", "header",
+          "headerless_sha256")
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Functions                                 #
+#                                                                      #
+# *********************************************************************#
+
+def default_cache_path():
+    """
+    return the default location of the cache file (per-user cache
+    folder, so that the same cache serves all libraries and packs).
+    """
+    if sys.platform.startswith("win"):
+        base_dir = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    else:
+        base_dir = os.environ.get("XDG_CACHE_HOME",
+                                  os.path.join(os.path.expanduser("~"),
+                                               ".cache"))
+    return os.path.join(base_dir, "Hardware-Target-Game-Database",
+                        CACHE_FILENAME)
+
+
+def open_cache(path, disabled, rebuild):
+    """
+    return a HashCache object, or None if caching is disabled.
+    """
+    if disabled:
+        return None
+    return HashCache(path or default_cache_path(), rebuild)
+
+
+def is_cache_file(filename, cache):
+    """
+    true if filename is the cache itself (or one of its sqlite
+    companion files), so it can be skipped when walking a folder.
+    """
+    if cache is None:
+        return False
+    return os.path.abspath(filename).startswith(cache.path)
+
+
+class HashCache(object):
+    """
+    map files to their hash values. Records are keyed by absolute
+    path, and are valid only as long as size, modification time and
+    inode are unchanged.
+
+    A record holds the SHA256, SHA1, MD5 and CRC32 hex digests of a
+    file, and the list of its zip members as [name, crc32, size]
+    triplets. Fields that were never computed are stored as NULL, and
+    an empty member list means that the file is not a zip archive.
+    The size of a ROM header (0 if none, see headers.py) and the
+    SHA256 of the ROM without it are also stored.
+    """
+
+    def __init__(self, path, rebuild=False):
+        self.path = os.path.abspath(path)
+        self.rebuild = rebuild  # ignore existing records, overwrite them
+        self.rebuilt = set()  # records stored by this run, when rebuilding
+        self.lookups = 0
+        self.misses = 0
+        self.pending = 0
+        self.lock = threading.Lock()
+        cache_dir = os.path.dirname(self.path)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=60,
+                                  check_same_thread=False)
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.db.execute("DROP TABLE IF EXISTS files")
+            self.db.execute("PRAGMA user_version = {}".format(
+                SCHEMA_VERSION))
+        self.db.execute("CREATE TABLE IF NOT EXISTS files ("
+                        "path TEXT PRIMARY KEY, "
+                        "size INTEGER, mtime INTEGER, inode INTEGER, "
+                        "sha256 TEXT, sha1 TEXT, md5 TEXT, crc32 TEXT, "
+                        "members TEXT, header INTEGER, "
+                        "headerless_sha256 TEXT)")
+        self.db.commit()
+
+    def _fetch(self, key, st):
+        """
+        return the stored record for key if it is still valid.
+        """
+        row = self.db.execute("SELECT size, mtime, inode, sha256, sha1, "
+                              "md5, crc32, members, header, "
+                              "headerless_sha256 FROM files "
+                              "WHERE path = ?", (key,)).fetchone()
+        if row is None or tuple(row[0:3]) != stat_key(st):
+            return None
+        record = dict(zip(FIELDS, row[3:]))
+        if record["members"] is not None:
+            record["members"] = json.loads(record["members"])
+        return record
+
+    def lookup(self, filename, st=None):
+        """
+        return a (stat, record) tuple. Record is a dictionary of hash
+        values. Values are None if the file is unknown, has changed
+        since it was hashed, or if they were never computed.
+        """
+        if st is None:
+            st = os.stat(filename)
+        with self.lock:
+            self.lookups += 1
+            record = None
+            if not self.rebuild:
+                record = self._fetch(os.path.abspath(filename), st)
+            return st, record or dict.fromkeys(FIELDS)
+
+    def store(self, filename, st, record):
+        """
+        save hash values computed for a file (a lookup that required
+        reading the file, so it counts as a cache miss). Fields absent
+        from record are kept if the stored record is still valid (when
+        rebuilding, only if it was stored by this run).
+        """
+        key = os.path.abspath(filename)
+        with self.lock:
+            self.misses += 1
+            merged = None
+            if not self.rebuild or key in self.rebuilt:
+                merged = self._fetch(key, st)
+            if self.rebuild:
+                self.rebuilt.add(key)
+            merged = merged or {}
+            merged.update((field, value) for field, value in record.items()
+                          if value is not None)
+            members = merged.get("members")
+            if members is not None:
+                members = json.dumps(members)
+            self.db.execute("INSERT OR REPLACE INTO files VALUES "
+                            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (key,) + stat_key(st) +
+                            (merged.get("sha256"), merged.get("sha1"),
+                             merged.get("md5"), merged.get("crc32"),
+                             members, merged.get("header"),
+                             merged.get("headerless_sha256")))
+            self.pending += 1
+            if self.pending >= COMMIT_INTERVAL:
+                self.db.commit()
+                self.pending = 0
+
+    def summary(self):
+        return "hash cache: {} hits, {} misses".format(
+            self.lookups - self.misses, self.misses)
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+def stat_key(st):
+    """
+    size, modification time (nanoseconds) and inode of a file.
+    """
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
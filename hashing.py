@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+file hashing shared by the build, parse and verify scripts: only the
+requested digests are computed, files are read into a buffer reused by
+each thread, and large files are memory-mapped.
+"""
+import os
+import mmap
+import zlib
+import hashlib
+import threading
+
+
+__author__ = "aquaman"
+__date__ = "2026/10/18"
+__version__ = "$Revision: 1.1"
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Constants                                 #
+#                                                                      #
+# *********************************************************************#
+
+DIGESTS = ("sha256", "sha1", "md5", "crc32")
+MIN_BUFFER = 128 * 1024  # read size, whatever the device
+MAX_BUFFER = 1024 * 1024
+BLOCKS = 32  # read size, in preferred I/O blocks of the device
+MMAP_SIZE = 64 * 2 ** 20  # files this large are memory-mapped
+MMAP_CHUNK = 8 * 2 ** 20  # bytes hashed at once, for memory-mapped files
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Functions                                 #
+#                                                                      #
+# *********************************************************************#
+
+_local = threading.local()  # buffer of each thread
+
+
+def buffer_size(st):
+    """
+    return the read size for a file: a multiple of the preferred I/O
+    block size of its device (see os.stat), between MIN_BUFFER and
+    MAX_BUFFER.
+    """
+    block_size = getattr(st, "st_blksize", 0) or 4096
+    return min(MAX_BUFFER, max(MIN_BUFFER, block_size * BLOCKS))
+
+
+def get_buffer(size):
+    """
+    return a writable memoryview of size bytes, reused by the next
+    calls made by the same thread.
+    """
+    view = getattr(_local, "view", None)
+    if view is None or len(view) < size:
+        view = _local.view = memoryview(bytearray(size))
+    return view[:size]
+
+
+def hash_file(filename, digests=DIGESTS, phase=None, header=0):
+    """
+    return the {digest: hex value} dictionary of a file, for the
+    requested digests (see DIGESTS). The number of bytes read is added
+    to phase (see metrics.Phase), if any.
+
+    If header is a number of bytes, the digests of the file without
+    its first header bytes are computed in the same pass, and returned
+    as a dictionary under the "headerless" key.
+    """
+    variants = [Digests(digests, 0)]
+    if header:
+        variants.append(Digests(digests, header))
+    size = 0
+    with open(filename, "rb", buffering=0) as f:
+        st = os.fstat(f.fileno())
+        if st.st_size >= MMAP_SIZE:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                mapped = None  # not a regular file, read it
+        else:
+            mapped = None
+        if mapped is not None:
+            with mapped, memoryview(mapped) as view:
+                for start in range(0, len(view), MMAP_CHUNK):
+                    with view[start:start + MMAP_CHUNK] as chunk:
+                        for variant in variants:
+                            variant.update(chunk, size)
+                        size += len(chunk)
+                        if phase is not None:
+                            phase.bytes += len(chunk)
+            # the file can grow after being mapped
+            f.seek(size)
+        buffer = get_buffer(buffer_size(st))
+        while True:
+            length = f.readinto(buffer)
+            if not length:
+                break
+            chunk = buffer[:length]
+            for variant in variants:
+                variant.update(chunk, size)
+            size += length
+            if phase is not None:
+                phase.bytes += length
+
+    values = variants[0].values()
+    if header:
+        values["headerless"] = variants[1].values()
+    return values
+
+
+class Digests(object):
+    """
+    digests of the data of a file, starting at offset.
+    """
+
+    def __init__(self, digests, offset=0):
+        self.hashers = {digest: hashlib.new(digest) for digest in digests
+                        if digest != "crc32"}
+        self.crc = 0 if "crc32" in digests else None
+        self.offset = offset
+
+    def update(self, chunk, position):
+        """
+        add a chunk of data read at position.
+        """
+        if position + len(chunk) <= self.offset:
+            return
+        if position < self.offset:
+            chunk = chunk[self.offset - position:]
+        for hasher in self.hashers.values():
+            hasher.update(chunk)
+        if self.crc is not None:
+            self.crc = zlib.crc32(chunk, self.crc)
+
+    def values(self):
+        values = {digest: hasher.hexdigest()
+                  for digest, hasher in self.hashers.items()}
+        if self.crc is not None:
+            values["crc32"] = '{0:08x}'.format(self.crc & 0xffffffff)
+        return values
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+ROM headers added by dumping tools and copiers: iNES (NES), copier
+headers (SNES) and Lynx headers. build_pack can match ROMs with or
+without these headers (see --headers).
+"""
+import os
+
+
+__author__ = "aquaman"
+__date__ = "2026/10/18"
+__version__ = "$Revision: 1.0"
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Constants                                 #
+#                                                                      #
+# *********************************************************************#
+
+INES_MAGIC = b"NES\x1a"
+INES_HEADER = 16
+LYNX_MAGIC = b"LYNX"
+LYNX_HEADER = 64
+COPIER_HEADER = 512  # SNES ROM sizes are multiples of 1 KiB without it
+COPIER_SUFFIXES = (".smc", ".sfc", ".swc", ".fig")  # must be lowercase
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Functions                                 #
+#                                                                      #
+# *********************************************************************#
+
+def header_size(filename, size):
+    """
+    return the size of the header of a ROM (0 if there is no known
+    header), from its first bytes, its size and its extension.
+    """
+    if (size % 1024 == COPIER_HEADER and
+            filename.lower().endswith(COPIER_SUFFIXES)):
+        return COPIER_HEADER
+    try:
+        with open(filename, "rb") as f:
+            magic = f.read(4)
+    except OSError:
+        return 0
+    if magic == INES_MAGIC and size > INES_HEADER:
+        return INES_HEADER
+    if magic == LYNX_MAGIC and size > LYNX_HEADER:
+        return LYNX_HEADER
+    return 0
+
+
+class Headerless(object):
+    """
+    a ROM without its header, opened like a zip archive (see
+    build_pack.extract_files): the name of its single member is the
+    size of the header.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def open(self, header):
+        f = open(self.filename, "rb")
+        f.seek(int(header), os.SEEK_SET)
+        return f
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+placement journal of build_pack, used to resume interrupted builds.
+"""
+import os
+import threading
+
+
+__author__ = "aquaman"
+__date__ = "2026/10/18"
+__version__ = "$Revision: 1.2"
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Constants                                 #
+#                                                                      #
+# *********************************************************************#
+
+JOURNAL_FILENAME = ".build_pack_journal.tsv"
+SYNC_INTERVAL = 256  # number of records between two fsyncs
+PLACED = "P"  # source, destination (relative to the output folder), size
+DONE = "D"  # source, size, modification time (nanoseconds)
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Functions                                 #
+#                                                                      #
+# *********************************************************************#
+
+def is_journal_file(filename):
+    """
+    true if filename is a placement journal, so it can be skipped when
+    walking a folder.
+    """
+    return os.path.basename(filename) == JOURNAL_FILENAME
+
+
+def sync_file(path):
+    """
+    flush the data of a file to disk (Windows needs write access).
+    """
+    fd = os.open(path, os.O_RDWR if os.name == "nt" else os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Journal(object):
+    """
+    write-ahead log of the files placed in an output folder.
+
+    A placement is recorded once the destination file is complete, and
+    a source is recorded as done once all its placements are recorded.
+    Records are kept in memory and appended in that order every
+    SYNC_INTERVAL records, after the destination files they list are
+    fsynced, and the journal is then fsynced: a placement is never on
+    disk before the data of its file (SD cards formatted with FAT or
+    exFAT do not order writes), and a done source always comes after
+    its placements, even if the build is interrupted by a power loss.
+
+    When resuming, the journal of the previous run is read first
+    (placements and done sources), and new records are appended to it.
+    """
+
+    def __init__(self, output_folder, resume=False):
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, JOURNAL_FILENAME)
+        self.placements = {}  # destination -> (source, size)
+        self.sources = {}  # source -> (size, modification time)
+        self.pending = []  # records not written yet
+        self.destinations = []  # files of these records, to fsync
+        self.lock = threading.Lock()
+        if resume and os.path.exists(self.path):
+            self._replay()
+        os.makedirs(output_folder, exist_ok=True)
+        self.file = open(self.path, "a" if resume else "w",
+                         encoding="utf-8")
+
+    def _replay(self):
+        with open(self.path, "r", encoding="utf-8") as journal:
+            for line in journal:
+                if not line.endswith("\n"):
+                    break  # interrupted while writing the last record
+                columns = line.rstrip("\n").split("\t")
+                try:
+                    if columns[0] == PLACED:
+                        source, destination, size = columns[1:]
+                        self.placements[destination] = (source, int(size))
+                    elif columns[0] == DONE:
+                        source, size, mtime = columns[1:]
+                        self.sources[source] = (int(size), int(mtime))
+                except ValueError:
+                    continue  # damaged record
+
+    def _write(self, *columns, destination=None):
+        with self.lock:
+            self.pending.append(columns)
+            if destination:
+                self.destinations.append(destination)
+            if len(self.pending) >= SYNC_INTERVAL:
+                self._sync()
+
+    def _sync(self):
+        for destination in self.destinations:
+            try:
+                sync_file(os.path.join(self.output_folder, destination))
+            except OSError:
+                pass  # long Windows path, or replaced since
+        for columns in self.pending:
+            print(*columns, sep="\t", file=self.file)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = []
+        self.destinations = []
+
+    def placed(self, source, destination, size):
+        """
+        record a complete destination file (path relative to the
+        output folder) of size bytes.
+        """
+        self._write(PLACED, os.path.abspath(source), destination, size,
+                    destination=destination)
+
+    def done(self, source, st):
+        """
+        record that all the placements of a source file are recorded.
+        """
+        self._write(DONE, os.path.abspath(source), st.st_size,
+                    st.st_mtime_ns)
+
+    def complete_placements(self, getsize=os.path.getsize):
+        """
+        return the destinations of the previous run that are still
+        complete, and the set of sources with incomplete destinations
+        (missing, or partially written).
+        """
+        complete = set()
+        incomplete_sources = set()
+        for destination, (source, size) in self.placements.items():
+            try:
+                path = os.path.join(self.output_folder, destination)
+                if getsize(path) == size:
+                    complete.add(destination)
+                    continue
+            except OSError:
+                pass
+            incomplete_sources.add(source)
+        return complete, incomplete_sources
+
+    def done_sources(self, incomplete_sources=()):
+        """
+        return the {source: (size, modification time)} dictionary of
+        sources done during the previous run, and whose destinations are
+        all complete.
+        """
+        return {source: stat for source, stat in self.sources.items()
+                if source not in incomplete_sources}
+
+    def close(self, remove=False):
+        """
+        sync and close the journal, and remove it (build finished).
+        """
+        with self.lock:
+            if not remove:
+                self._sync()
+            self.file.close()
+        if remove:
+            os.remove(self.path)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+run statistics shared by the build, parse and verify scripts: time
+spent per phase, counters (files, bytes, system calls), throughput of
+large files, and optional profiling (see --stats, --stats_json and
+--profile).
+"""
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+from collections import Counter, defaultdict
+
+
+__author__ = "aquaman"
+__date__ = "2026/10/18"
+__version__ = "$Revision: 1.1"
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Constants                                 #
+#                                                                      #
+# *********************************************************************#
+
+LARGE_FILE = 8 * 2 ** 20  # throughput is sampled for files this large
+PERCENTILES = (50, 90, 99)
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Functions                                 #
+#                                                                      #
+# *********************************************************************#
+
+def add_arguments(parser):
+    """
+    add the --stats, --stats_json and --profile options to a parser.
+    """
+    # Valid uses of this flag include: --stats, --stats true
+    parser.add_argument("--stats",
+                        dest="stats",
+                        default=False,
+                        nargs="?",
+                        const=True,
+                        type='bool',
+                        help=("Print the time spent in each phase, the "
+                              "number of files and bytes read and written, "
+                              "and the throughput of large files."))
+
+    parser.add_argument("--stats_json",
+                        dest="stats_json",
+                        default=None,
+                        help="write the statistics of the run (JSON)")
+
+    parser.add_argument("--profile",
+                        dest="profile",
+                        default=None,
+                        help=("profile the run (all threads), and write "
+                              "the profile (cProfile format, see the "
+                              "python pstats module)"))
+
+
+class Phase(object):
+    """
+    a timed operation (see Metrics.phase), the code in the phase adds
+    the number of bytes it reads or writes.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+
+
+def percentile(values, p):
+    """
+    return the p-th percentile of a sorted list (nearest rank).
+    """
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+class Metrics(object):
+    """
+    thread-safe statistics of a run.
+
+    Phases are timed in each thread, so the time spent in a phase by
+    concurrent workers can exceed the duration of the run. The
+    throughput of a phase is sampled for large files (see LARGE_FILE),
+    smaller files are dominated by the cost of opening them.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.counters = Counter()
+        # name -> calls, seconds, bytes
+        self.phases = defaultdict(lambda: [0, 0.0, 0])
+        self.throughputs = defaultdict(list)  # kind -> MB/s samples
+        self.lock = threading.Lock()
+        self.profiles = []
+        self.thread_profile = threading.local()
+        self.profiling = False
+        # measurements costing a system call are done only if statistics
+        # are requested (see configure)
+        self.detailed = False
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.counters[key] += value
+
+    @contextlib.contextmanager
+    def phase(self, name, counter=None):
+        """
+        time a phase, and add the bytes it processed to counter (for
+        instance bytes_read or bytes_written).
+        """
+        phase = Phase()
+        start = time.perf_counter()
+        try:
+            yield phase
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.phases[name][0] += 1
+                self.phases[name][1] += elapsed
+                self.phases[name][2] += phase.bytes
+                if counter:
+                    self.counters[counter] += phase.bytes
+                if phase.bytes >= LARGE_FILE and elapsed > 0:
+                    self.throughputs[name].append(
+                        phase.bytes / 2 ** 20 / elapsed)
+
+    def start_profile(self):
+        """
+        profile the main thread, and the functions wrapped with
+        profiled (worker threads).
+        """
+        self.profiling = True
+        self.profiles.append(cProfile.Profile())
+        self.profiles[0].enable()
+
+    def profiled(self, function):
+        """
+        wrap function, so that it is profiled in the thread calling it
+        (if profiling is on).
+        """
+        if not self.profiling:
+            return function
+
+        def wrapper(*args, **kwargs):
+            profile = getattr(self.thread_profile, "profile", None)
+            if profile is None:
+                profile = self.thread_profile.profile = cProfile.Profile()
+                with self.lock:
+                    self.profiles.append(profile)
+            try:
+                profile.enable()
+            except ValueError:
+                # a single profiler at a time (python 3.12 and newer)
+                return function(*args, **kwargs)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profile.disable()
+        return wrapper
+
+    def dump_profile(self, profile_file):
+        self.profiles[0].disable()
+        with self.lock:
+            stats = pstats.Stats(self.profiles[0])
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+        stats.dump_stats(profile_file)
+
+    def as_dict(self):
+        with self.lock:
+            throughputs = {}
+            for kind, samples in self.throughputs.items():
+                samples = sorted(samples)
+                throughputs[kind] = dict(
+                    [("files", len(samples))] +
+                    [("p{}".format(p), round(percentile(samples, p), 2))
+                     for p in PERCENTILES])
+            return {
+                "seconds": round(time.perf_counter() - self.start, 4),
+                "phases": {name: {"calls": calls,
+                                  "seconds": round(seconds, 4),
+                                  "bytes": size}
+                           for name, (calls, seconds, size)
+                           in sorted(self.phases.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "throughput_mb_per_second": throughputs
+            }
+
+    def print_summary(self, file=None):
+        if file is None:
+            file = sys.stdout
+        summary = self.as_dict()
+        print("run: {:.3f} seconds".format(summary["seconds"]), file=file)
+        for name, phase in summary["phases"].items():
+            print("phase {}: {} calls, {:.3f} seconds, {} bytes".format(
+                name, phase["calls"], phase["seconds"], phase["bytes"]),
+                file=file)
+        for key, value in summary["counters"].items():
+            print("{}: {}".format(key, value), file=file)
+        for kind, percentiles in summary[
+                "throughput_mb_per_second"].items():
+            print("{} throughput (files of {} MiB or more): {} files, "
+                  "{} MB/s".format(kind, LARGE_FILE // 2 ** 20,
+                                   percentiles["files"],
+                                   ", ".join("{} {}".format(p, value)
+                                             for p, value
+                                             in percentiles.items()
+                                             if p != "files")),
+                  file=file)
+
+    def write_json(self, json_file):
+        with open(json_file, "w") as output:
+            json.dump(self.as_dict(), output, indent=1)
+            print(file=output)
+
+    def configure(self, args):
+        """
+        start profiling and detailed measurements, as requested by the
+        command line options (see add_arguments).
+        """
+        self.detailed = bool(args.stats or args.stats_json)
+        if args.profile:
+            self.start_profile()
+
+    def finish(self, args):
+        """
+        print or write the statistics and the profile, as requested by
+        the command line options (see add_arguments).
+        """
+        if args.profile:
+            self.dump_profile(args.profile)
+        if args.stats:
+            self.print_summary()
+        if args.stats_json:
+            self.write_json(args.stats_json)
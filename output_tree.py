@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+in-memory view of the output folders of build_pack, so that checking
+if a file exists or creating a directory does not cost a system call
+per database entry.
+"""
+import os
+import threading
+from collections import Counter
+
+
+__author__ = "aquaman"
+__date__ = "2026/10/18"
+__version__ = "$Revision: 1.0"
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Functions                                 #
+#                                                                      #
+# *********************************************************************#
+
+def key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+class OutputTree(object):
+    """
+    directories and files (with their sizes) of scanned folders.
+
+    Folders are scanned once (see scan), and the view is then updated
+    as files are written, removed and directories created. Paths that
+    are not in a scanned folder are checked on disk.
+    """
+
+    def __init__(self):
+        self.roots = []
+        self.directories = set()
+        self.files = {}  # path -> size (None if not known yet)
+        self.system_calls = Counter()  # made on behalf of the callers
+        self.lock = threading.Lock()
+
+    def scan(self, root):
+        """
+        read the directories and files of root (file sizes are read
+        later, if needed).
+        """
+        root = key(root)
+        with self.lock:
+            self.roots.append(root)
+            if not os.path.isdir(root):
+                return
+            self.directories.add(root)
+            folders = [root]
+            while folders:
+                self.system_calls["scandir"] += 1
+                with os.scandir(folders.pop()) as entries:
+                    for entry in entries:
+                        path = key(entry.path)
+                        if entry.is_dir(follow_symlinks=False):
+                            self.directories.add(path)
+                            folders.append(path)
+                        else:
+                            self.files[path] = None
+
+    def _scanned(self, path):
+        return any(path == root or path.startswith(root + os.sep)
+                   for root in self.roots)
+
+    def exists(self, path):
+        k = key(path)
+        with self.lock:
+            if k in self.files or k in self.directories:
+                return True
+            if self._scanned(k):
+                return False
+            self.system_calls["stat"] += 1
+        return os.path.exists(path)
+
+    def getsize(self, path):
+        """
+        return the size of a file (read once from disk), raise OSError
+        if the file does not exist.
+        """
+        k = key(path)
+        with self.lock:
+            if k not in self.files and self._scanned(k):
+                raise FileNotFoundError(path)
+            size = self.files.get(k)
+            if size is None:
+                self.system_calls["stat"] += 1
+        if size is None:
+            size = os.path.getsize(path)
+            with self.lock:
+                if k in self.files:
+                    self.files[k] = size
+        return size
+
+    def makedirs(self, path):
+        """
+        create a directory and its parents, unless they exist.
+        """
+        k = key(path)
+        with self.lock:
+            if k in self.directories:
+                return
+            self.system_calls["makedirs"] += 1
+        os.makedirs(path, exist_ok=True)
+        with self.lock:
+            while k and k not in self.directories:
+                self.directories.add(k)
+                parent = os.path.dirname(k)
+                if parent == k:
+                    break
+                k = parent
+
+    def add(self, path, size=None):
+        """
+        record a file written (size None if not known).
+        """
+        path = key(path)
+        with self.lock:
+            if self._scanned(path):
+                self.files[path] = size
+
+    def remove(self, path):
+        """
+        record a file removed.
+        """
+        with self.lock:
+            self.files.pop(key(path), None)
@@ -5,16 +5,58 @@ for a given folder, produce a list of file names with relative
 paths and hash values.
 """
 import os
+import re
 import sys
-import time
-import zlib
-import hashlib
+import heapq
 import argparse
+import hash_cache
+import metrics
+import hashing
+import pipeline
+import progress
 
 
 __author__ = "aquaman"
-__date__ = "2022/06/10"
-__version__ = "$Revision: 4.6"
+__date__ = "2026/10/18"
+__version__ = "$Revision: 5.6"
+
+HASH_CACHE = None  # set when the script is run, see hash_cache.py
+METRICS = metrics.Metrics()  # run statistics, see metrics.py
+PROGRESS = None  # jsonl progress events, see progress.py
+PREVIOUS = None  # records of the SMDB being updated, see --update
+MTIME_SUFFIX = ".mtime"  # sidecar file: path, size, modification time
+MAX_PATH = 260  # longest path supported by default on Windows
+
+# list folders and files to exclude
+BANNED_FOLDERS = ("/AUTO/", "/CPAK/",
+                  "/Documentation/", "/ED64/",
+                  "/EDFC/", "/EDGB/",
+                  "/EDMD/", "/Extended SSF Dev Demo Sample - Krikzz/src/",
+                  "/Firmware Backup/", "/GBASYS/",
+                  "/Images/", "/MEGA/",
+                  "/Manuals/", "/PALETTE/",
+                  "/PATTERN/", "/SAVE/",
+                  "/SNAP/", "/SOUNDS/",
+                  "/SPED/", "/SYSTEM/",
+                  "/System Test Images/",
+                  "/System Volume Information/",
+                  "/TBED/", "/TEXT/",
+                  "/_PREVIEW/", "/menu/",
+                  "/ntm_firmware_ver", "/sd2snes Themes/",
+                  "/sd2snes/")
+BANNED_SUFFIXES = (".001", ".002", ".003", ".004", ".005", ".006",
+                   ".007", ".008", ".009", ".aps", ".asm",
+                   ".bak", ".bat", ".bsa", ".bps",
+                   ".bst", ".c", ".cht", ".dat", ".db", ".docx",
+                   ".exe", ".ips", ".jpg", ".json", ".mso",
+                   ".ods", ".odt", ".pc", ".pdf", ".srm",
+                   ".sto", ".tmp", ".xdelta", ".xls",
+                   "/os.pce", "/thumbs.db", "/menu.bin", "/desktop.ini",
+                   "/.ds_store")  # must be lowercase
+# a path is excluded if it contains one of the banned folders (a
+# single regular expression, instead of one test per banned folder)
+BANNED_FOLDERS_RE = re.compile("|".join(re.escape(folder)
+                                        for folder in BANNED_FOLDERS))
 
 
 # *********************************************************************#
@@ -56,7 +98,77 @@ def option_parse():
                         help=("Changes the way the stdout is printed, and "
                               "allows for UI subprocess monitoring."))
 
-    return parser.parse_args()
+    # Valid uses of this flag include: --strict, --strict true
+    parser.add_argument("--strict",
+                        dest="strict",
+                        default=False,
+                        nargs="?",
+                        const=True,
+                        type='bool',
+                        help=("Exit with an error at the end of the run if "
+                              "file names are not portable (non-ASCII "
+                              "characters, long paths, names differing "
+                              "only by case, trailing dots or spaces)."))
+
+    parser.add_argument("--cache",
+                        dest="cache_file",
+                        default=None,
+                        help=("set hash cache file (default: {})".format(
+                            hash_cache.default_cache_path())))
+
+    # Valid uses of this flag include: --no_cache, --no_cache true
+    parser.add_argument("--no_cache",
+                        dest="no_cache",
+                        default=False,
+                        nargs="?",
+                        const=True,
+                        type='bool',
+                        help=("Do not read or update the hash cache, "
+                              "hash every file."))
+
+    # Valid uses of this flag include: --rebuild_cache, --rebuild_cache 1
+    parser.add_argument("--rebuild_cache",
+                        dest="rebuild_cache",
+                        default=False,
+                        nargs="?",
+                        const=True,
+                        type='bool',
+                        help=("Ignore cached hash values, hash every file "
+                              "and refresh the hash cache."))
+
+    parser.add_argument("-j", "--jobs",
+                        dest="jobs",
+                        default=1,
+                        type=int,
+                        help=("Number of files hashed concurrently "
+                              "(default: 1). Records are written in the "
+                              "same order whatever the number of jobs."))
+
+    parser.add_argument("--queue_size",
+                        dest="queue_size",
+                        default=pipeline.QUEUE_SIZE,
+                        type=int,
+                        help=("Number of files waiting to be hashed "
+                              "(default: {}).".format(pipeline.QUEUE_SIZE)))
+
+    parser.add_argument("--update",
+                        dest="update_file",
+                        default=None,
+                        help=("previous SMDB of the folder: files whose path "
+                              "and size did not change (and modification "
+                              "time, if recorded in the {} file next to "
+                              "the SMDB) are not hashed again".format(
+                                  MTIME_SUFFIX)))
+
+    metrics.add_arguments(parser)
+    progress.add_arguments(parser)
+
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("the number of jobs must be at least 1")
+    if args.queue_size < 1:
+        parser.error("the queue size must be at least 1")
+    return args
 
 
 def print_progress(current, end):
@@ -67,111 +179,286 @@ def print_function(text, end, file=sys.stdout, flush=True):
     print(text, end=end, file=file, flush=flush)
 
 
-def parse_folder(target_folder, output_file):
-    """
-    read each file and produce a hash value.
-    """
-    # list folders and files to exclude
-    banned_folders = ("/AUTO/", "/CPAK/",
-                      "/Documentation/", "/ED64/",
-                      "/EDFC/", "/EDGB/",
-                      "/EDMD/", "/Extended SSF Dev Demo Sample - Krikzz/src/",
-                      "/Firmware Backup/", "/GBASYS/",
-                      "/Images/", "/MEGA/",
-                      "/Manuals/", "/PALETTE/",
-                      "/PATTERN/", "/SAVE/",
-                      "/SNAP/", "/SOUNDS/",
-                      "/SPED/", "/SYSTEM/",
-                      "/System Test Images/",
-                      "/System Volume Information/",
-                      "/TBED/", "/TEXT/",
-                      "/_PREVIEW/", "/menu/",
-                      "/ntm_firmware_ver", "/sd2snes Themes/",
-                      "/sd2snes/")
-    banned_suffixes = (".001", ".002", ".003", ".004", ".005", ".006",
-                       ".007", ".008", ".009", ".aps", ".asm",
-                       ".bak", ".bat", ".bsa", ".bps",
-                       ".bst", ".c", ".cht", ".dat", ".db", ".docx",
-                       ".exe", ".ips", ".jpg", ".json", ".mso",
-                       ".ods", ".odt", ".pc", ".pdf", ".srm",
-                       ".sto", ".tmp", ".xdelta", ".xls",
-                       "/os.pce", "/thumbs.db", "/menu.bin", "/desktop.ini",
-                       "/.ds_store")  # must be lowercase
-
-    with open(output_file, "w") as output_file:
+def parse_folder(target_folder, output_file, problems):
+    """
+    read each file and produce a hash value, and return the number of
+    files listed. File names that are not portable are added to
+    problems (see check_path).
+    """
+    # modification times are recorded for the next update
+    mtime_file = open(output_file + MTIME_SUFFIX, "w")
+    with mtime_file, open(output_file, "w") as output_file:
         i = 0
-        # make sure subfolders are alphanumerically sorted
-        sorted_files = sorted(os.walk(target_folder), key=lambda x: x[0].lower())
-        for dirpath, dirnames, filenames in sorted_files:
-            if filenames:
-                # make sure files are alphanumerically sorted
-                filenames.sort(key=lambda v: (v.upper(), v[0].islower()))
-                for f in filenames:
-                    filename = os.path.join(os.path.normpath(dirpath), f)
-                    absolute_filename = os.path.abspath(filename)
-                    os.path.isfile(absolute_filename)
-                    # convert to Unix format by default
-                    filename = filename.replace("\\", "/")
-                    # Report filenames with non-ASCII characters
-                    try:
-                        filename.encode('ascii')
-                    except UnicodeEncodeError:
-                        print("Error (non-ASCII character):", filename,
-                              file=sys.stdout)
-                        time.sleep(10)  # alternatively: sys.exit(1)
-                    sha256 = hashlib.sha256()
-                    sha1 = hashlib.sha1()
-                    md5 = hashlib.md5()
-                    crc = 0
-                    size = 0
-
-                    # exclude certain folders and files
-                    if not (any(s in filename for s in banned_folders) or
-                            filename.lower().endswith(banned_suffixes)):
-                        try:
-                            with open(absolute_filename,
-                                      "rb",
-                                      buffering=0) as f:
-                                # use a small buffer to compute hash
-                                # values to avoid storing large files
-                                # in memory (changing buffer size does
-                                # not change parsing speed much)
-                                for b in iter(lambda: f.read(128 * 1024), b''):
-                                    sha256.update(b)
-                                    sha1.update(b)
-                                    md5.update(b)
-                                    crc = zlib.crc32(b, crc)
-                                size = os.path.getsize(f.name)
-
-                        except FileNotFoundError:
-                            # Windows default API is limited to paths of
-                            # 260 characters
-                            absolute_filename = u'\\\\?\\' + absolute_filename
-                            with open(absolute_filename,
-                                      "rb",
-                                      buffering=0) as f:
-                                for b in iter(lambda: f.read(128 * 1024), b''):
-                                    sha256.update(b)
-                                    sha1.update(b)
-                                    md5.update(b)
-                                    crc = zlib.crc32(b, crc)
-                                size = os.path.getsize(f.name)
-
-                        print(sha256.hexdigest(),
-                              filename,
-                              sha1.hexdigest(),
-                              md5.hexdigest(),
-                              '{0:08x}'.format(crc & 0xffffffff),
-                              size,
-                              sep="\t",
-                              file=output_file)
-                        i += 1
-                        print_progress(i, END_LINE)
-        else:
-            if not args.new_line:
-                print_progress(i, "\n")
-
-    return None
+        if PROGRESS:
+            PROGRESS.phase("parse")
+        # files are hashed concurrently (see --jobs), and records are
+        # written in sorted order
+        hashing = pipeline.Stage("hash", args.jobs, args.queue_size)
+        files = list_files(sorted_walk(target_folder), problems)
+        for (filename, absolute_filename), (hashes, st, reused) in \
+                pipeline.ordered_map(METRICS.profiled(hash_file), files,
+                                     hashing):
+            sha256, sha1, md5, crc, size = hashes
+            print(sha256,
+                  filename,
+                  sha1,
+                  md5,
+                  crc,
+                  size,
+                  sep="\t",
+                  file=output_file)
+            if PREVIOUS is not None:
+                compare_record(filename, hashes, reused)
+            print(filename, size, st.st_mtime_ns, sep="\t",
+                  file=mtime_file)
+            i += 1
+            if PROGRESS:
+                PROGRESS.done(absolute_filename)
+            else:
+                print_progress(i, END_LINE)
+        if PROGRESS:
+            PROGRESS.end_phase()
+        elif not args.new_line:
+            print_progress(i, "\n")
+    if PREVIOUS is not None:
+        # files listed in the previous SMDB, but not found this time
+        METRICS.count("records_removed", len(PREVIOUS))
+
+    return i
+
+
+def is_banned_folder(dirpath):
+    """
+    true if the files of a folder (and of its subfolders) are all
+    excluded.
+    """
+    path = os.path.normpath(dirpath).replace("\\", "/") + "/"
+    return BANNED_FOLDERS_RE.search(path) is not None
+
+
+def sorted_walk(target_folder):
+    """
+    yield (dirpath, dirnames, filenames) tuples, as os.walk, but sorted
+    by lowercase folder path (the order of sorted(os.walk(...))), one
+    folder at a time. Banned folders are not walked.
+
+    Folders waiting to be read are kept in a heap: the subfolders of a
+    folder always sort after it, so the smallest folder in the heap is
+    the next one in sorted order.
+    """
+    heap = [(target_folder.lower(), 0, target_folder)]
+    number = 0  # folders with the same lowercase path keep walking order
+    while heap:
+        _, _, dirpath = heapq.heappop(heap)
+        dirnames = []
+        filenames = []
+        with METRICS.phase("walk"):
+            try:
+                entries = list(os.scandir(dirpath))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    filenames.append(entry.name)
+                    continue
+                dirnames.append(entry.name)
+                # symbolic links to folders are not followed (os.walk)
+                path = os.path.join(dirpath, entry.name)
+                if not entry.is_symlink() and not is_banned_folder(path):
+                    number += 1
+                    heapq.heappush(heap, (path.lower(), number, path))
+        yield dirpath, dirnames, filenames
+
+
+def list_files(sorted_files, problems):
+    """
+    yield the (filename, absolute filename) of each file to hash, in
+    sorted order (filenames are converted to Unix format). The names of
+    these files are checked at the same time (see check_path).
+    """
+    lowercase_paths = {}
+    for dirpath, dirnames, filenames in sorted_files:
+        # make sure files are alphanumerically sorted
+        filenames.sort(key=lambda v: (v.upper(), v[0].islower()))
+        for f in filenames:
+            filename = os.path.join(os.path.normpath(dirpath), f)
+            absolute_filename = os.path.abspath(filename)
+            if PROGRESS:
+                PROGRESS.add(absolute_filename)
+            # convert to Unix format by default
+            filename = filename.replace("\\", "/")
+            # exclude certain folders and files
+            if (BANNED_FOLDERS_RE.search(filename) or
+                    filename.lower().endswith(BANNED_SUFFIXES) or
+                    hash_cache.is_cache_file(absolute_filename, HASH_CACHE)):
+                if PROGRESS:
+                    PROGRESS.done(absolute_filename)
+                continue
+            check_path(filename, lowercase_paths, problems)
+            yield filename, absolute_filename
+    if PROGRESS:
+        PROGRESS.scanned()
+
+
+def check_path(filename, lowercase_paths, problems):
+    """
+    add (problem, filename) tuples to problems if a file name is not
+    portable: non-ASCII characters, path longer than MAX_PATH, same
+    path as a previous file except for case (a single file on FAT and
+    exFAT SD cards), or folder or file name ending with a dot or a
+    space (removed by Windows).
+    """
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        problems.append(("non-ASCII character", filename))
+    if len(filename) > MAX_PATH:
+        problems.append(("longer than {} characters".format(MAX_PATH),
+                         filename))
+    lowercase_path = filename.lower()
+    if lowercase_path in lowercase_paths:
+        problems.append(("same name as {}".format(
+            lowercase_paths[lowercase_path]), filename))
+    else:
+        lowercase_paths[lowercase_path] = filename
+    if any(name.endswith((".", " ")) for name in filename.split("/")
+           if name not in (".", "..")):
+        problems.append(("trailing dot or space", filename))
+
+
+def print_problems(problems, strict):
+    """
+    print the file names that are not portable (see check_path).
+    """
+    for problem, filename in problems:
+        print("{} ({}):".format("Error" if strict else "Warning", problem),
+              filename, file=sys.stdout)
+    if problems:
+        print("file names: {} problems".format(len(problems)),
+              file=sys.stdout)
+
+
+def hash_file(names):
+    """
+    get_hashes of a (filename, absolute filename) pair, with a
+    fallback for long Windows paths. Return the hash values and size
+    of the file, its stat result (for the modification time, see
+    MTIME_SUFFIX), and whether the hash values are reused from the
+    SMDB to update (see --update and previous_record).
+    """
+    filename, absolute_filename = names
+    try:
+        st = os.stat(absolute_filename)
+    except FileNotFoundError:
+        # Windows default API is limited to paths of 260 characters
+        absolute_filename = u'\\\\?\\' + absolute_filename
+        st = os.stat(absolute_filename)
+    if PREVIOUS is not None:
+        record = previous_record(filename, st)
+        if record:
+            METRICS.count("records_reused")
+            return record, st, True
+    return get_hashes(absolute_filename, st), st, False
+
+
+def read_previous(update_file):
+    """
+    return the {filename: (sha256, sha1, md5, crc32, size,
+    modification time)} dictionary of a SMDB to update. Size and
+    modification time are None if not recorded (files without a size
+    are hashed again).
+    """
+    records = {}
+    with open(update_file, "r") as smdb:
+        for line in smdb:
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) < 5:
+                continue
+            sha256, filename, sha1, md5, crc = columns[:5]
+            size = None
+            if len(columns) > 5 and columns[5].isdigit():
+                size = int(columns[5])
+            records[filename] = (sha256, sha1, md5, crc, size, None)
+    if os.path.exists(update_file + MTIME_SUFFIX):
+        with open(update_file + MTIME_SUFFIX, "r") as mtime_file:
+            for line in mtime_file:
+                columns = line.rstrip("\n").split("\t")
+                if len(columns) != 3 or columns[0] not in records:
+                    continue
+                record = records[columns[0]]
+                # a modification time is valid for the same file size
+                if columns[1] == str(record[4]) and columns[2].isdigit():
+                    records[columns[0]] = record[:5] + (int(columns[2]),)
+    return records
+
+
+def previous_record(filename, st):
+    """
+    return the hash values and size of a file listed in the SMDB to
+    update, if its size and modification time did not change, or None.
+
+    Without a recorded modification time (no MTIME_SUFFIX file next to
+    the SMDB), the hash cache is used instead, as it also checks the
+    modification time: the size alone is trusted only if the cache is
+    disabled (see --no_cache).
+    """
+    record = PREVIOUS.get(filename)
+    if record is None:
+        return None
+    sha256, sha1, md5, crc, size, mtime = record
+    if size != st.st_size:
+        return None
+    if mtime is None and HASH_CACHE:
+        return None
+    if mtime not in (None, st.st_mtime_ns):
+        return None
+    return sha256, sha1, md5, crc, size
+
+
+def compare_record(filename, hashes, reused=False):
+    """
+    count a record as added, changed or unchanged, compared to the SMDB
+    to update (records left in PREVIOUS are the removed ones). Reused
+    records (see previous_record) are not compared: the file was not
+    read, so it cannot be known to be unchanged.
+    """
+    record = PREVIOUS.pop(filename, None)
+    if reused:
+        return
+    if record is None:
+        METRICS.count("records_added")
+    elif record[:4] != tuple(hashes[:4]):
+        METRICS.count("records_changed")
+    else:
+        METRICS.count("records_unchanged")
+
+
+def get_hashes(filename, st=None):
+    """
+    return sha256, sha1, md5 and crc32 hex values, and the size of
+    the file (st is its stat result, if known).
+    """
+    # hash values computed during a previous run
+    if HASH_CACHE:
+        st, record = HASH_CACHE.lookup(filename, st)
+        if all(record[field] for field in ("sha256", "sha1", "md5", "crc32")):
+            return (record["sha256"], record["sha1"], record["md5"],
+                    record["crc32"], st.st_size)
+
+    with METRICS.phase("hash", "bytes_read") as phase:
+        record = hashing.hash_file(filename, hashing.DIGESTS, phase)
+        size = phase.bytes
+    METRICS.count("files_hashed")
+
+    if HASH_CACHE:
+        HASH_CACHE.store(filename, st, record)
+
+    return (record["sha256"], record["sha1"], record["md5"],
+            record["crc32"], size)
 
 
 # *********************************************************************#
@@ -182,11 +469,38 @@ def parse_folder(target_folder, output_file):
 
 if __name__ == '__main__':
     args = option_parse()
+    METRICS.configure(args)
+    PROGRESS = progress.open_progress(args)
     TARGET_FOLDER = args.target_folder
     OUTPUT_FILE = args.output_file
     END_LINE = "\n" if args.new_line else "\r"
+    HASH_CACHE = hash_cache.open_cache(args.cache_file,
+                                       args.no_cache,
+                                       args.rebuild_cache)
+    PATH_PROBLEMS = []
+    if args.update_file:
+        PREVIOUS = read_previous(args.update_file)
     if os.path.lexists(TARGET_FOLDER):
         TARGET_FOLDER = os.path.normpath(TARGET_FOLDER)
-        parse_folder(TARGET_FOLDER, OUTPUT_FILE)
+        FILES = parse_folder(TARGET_FOLDER, OUTPUT_FILE, PATH_PROBLEMS)
+    else:
+        FILES = 0
+    if HASH_CACHE:
+        HASH_CACHE.close()
+        print(HASH_CACHE.summary(), file=sys.stdout)
+    if args.update_file:
+        print("update: {} added, {} removed, {} changed, {} unchanged, "
+              "{} reused without hashing".format(
+                  METRICS.counters["records_added"],
+                  METRICS.counters["records_removed"],
+                  METRICS.counters["records_changed"],
+                  METRICS.counters["records_unchanged"],
+                  METRICS.counters["records_reused"]), file=sys.stdout)
+    print_problems(PATH_PROBLEMS, args.strict)
+    if PROGRESS:
+        PROGRESS.summary(output_file=OUTPUT_FILE, files=FILES,
+                         path_problems=len(PATH_PROBLEMS))
+
+    METRICS.finish(args)
 
-    sys.exit(0)
+    sys.exit(1 if args.strict and PATH_PROBLEMS else 0)
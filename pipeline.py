@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+staged processing with bounded queues: items produced by a scanner
+thread are processed by a pool of workers, and results are consumed in
+scanning order, while another pool of workers writes files.
+"""
+import time
+import queue
+import threading
+import concurrent.futures
+
+
+__author__ = "aquaman"
+__date__ = "2026/10/18"
+__version__ = "$Revision: 1.1"
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Constants                                 #
+#                                                                      #
+# *********************************************************************#
+
+QUEUE_SIZE = 64  # default number of items waiting between two stages
+END = object()  # end of the scanned items
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Functions                                 #
+#                                                                      #
+# *********************************************************************#
+
+class Stage(object):
+    """
+    statistics of a pipeline stage: number of items processed, time
+    spent by its workers, and depth of its input queue (sampled each
+    time an item enters or leaves the queue).
+    """
+
+    def __init__(self, name, workers=1, queue_size=QUEUE_SIZE):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.items = 0
+        self.busy = 0.0
+        self.samples = 0
+        self.depth_total = 0
+        self.depth_max = 0
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def count(self, items=1, busy=0.0):
+        with self.lock:
+            self.items += items
+            self.busy += busy
+
+    def sample(self, depth):
+        with self.lock:
+            self.samples += 1
+            self.depth_total += depth
+            self.depth_max = max(self.depth_max, depth)
+
+    def timed(self, function):
+        """
+        wrap function, so that its calls are counted and timed.
+        """
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.count(1, time.perf_counter() - start)
+        return wrapper
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.items / elapsed if elapsed else 0.0
+        depth = self.depth_total / self.samples if self.samples else 0.0
+        busy = self.busy / (elapsed * self.workers) if elapsed else 0.0
+        summary = "{}: {} files ({:.1f} files/s)".format(self.name,
+                                                        self.items, rate)
+        if self.busy:
+            summary += ", {} workers ({:.0%} busy)".format(self.workers, busy)
+        if self.samples:
+            summary += (", queue depth {:.1f} on average, {} max "
+                        "(of {})".format(depth, self.depth_max,
+                                         self.queue_size))
+        return summary
+
+
+def ordered_map(function, items, stage):
+    """
+    apply function to items with stage.workers threads, and yield
+    (item, result) tuples in the order of items.
+
+    items is iterated in a separate thread (the scanner), which waits
+    when stage.queue_size items are in flight, so that scanning,
+    processing and the consumer all run at the same time, within
+    bounded memory. An exception raised by the scanner or by function
+    is raised again in the consumer.
+    """
+    in_flight = queue.Queue(maxsize=stage.queue_size)
+    timed_function = stage.timed(function)
+
+    def scan(executor):
+        try:
+            for item in items:
+                in_flight.put((item, executor.submit(timed_function, item)))
+                stage.sample(in_flight.qsize())
+        except BaseException as error:
+            in_flight.put((END, error))
+            return
+        in_flight.put((END, None))
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, stage.workers)) as executor:
+        scanner = threading.Thread(target=scan, args=(executor,),
+                                   daemon=True)
+        scanner.start()
+        while True:
+            item, future = in_flight.get()
+            stage.sample(in_flight.qsize())
+            if item is END:
+                if future is not None:
+                    raise future
+                break
+            yield item, future.result()
+
+
+class WorkerPool(object):
+    """
+    pool of worker threads with a bounded queue (submit waits while
+    stage.queue_size jobs are pending).
+
+    Each job is submitted with the keys (destination files) it writes,
+    and a job starts only after the previous jobs writing one of its
+    keys are finished, so that the result does not depend on the
+    number of workers. The first exception raised by a job is raised
+    again by the next call to submit, wait or close.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, stage.workers))
+        self.slots = threading.Semaphore(stage.queue_size)
+        self.pending = 0
+        self.in_flight = {}  # key -> future of the last job writing it
+        self.error = None
+        self.lock = threading.Lock()
+
+    def _finished(self, future):
+        with self.lock:
+            self.pending -= 1
+            for key in [key for key, job in self.in_flight.items()
+                        if job is future]:
+                del self.in_flight[key]
+            if future.exception() is not None and self.error is None:
+                self.error = future.exception()
+        self.slots.release()
+
+    def _raise(self):
+        if self.error is not None:
+            raise self.error
+
+    def wait(self, keys):
+        """
+        wait until the jobs writing one of keys are finished.
+        """
+        with self.lock:
+            jobs = [self.in_flight[key] for key in keys
+                    if key in self.in_flight]
+        concurrent.futures.wait(jobs)
+        self._raise()
+
+    def submit(self, keys, function, *args):
+        self.wait(keys)
+        self.slots.acquire()
+        with self.lock:
+            self.pending += 1
+            self.stage.sample(self.pending)
+            future = self.executor.submit(self.stage.timed(function), *args)
+            for key in keys:
+                self.in_flight[key] = future
+        future.add_done_callback(self._finished)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self._raise()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+machine-readable progress of the build, parse and verify scripts: one
+JSON object per line (see --progress_format jsonl), for graphical
+front-ends.
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+
+__author__ = "aquaman"
+__date__ = "2026/10/18"
+__version__ = "$Revision: 1.1"
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Constants                                 #
+#                                                                      #
+# *********************************************************************#
+
+RATE = 4.0  # default maximum number of progress events per second
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Functions                                 #
+#                                                                      #
+# *********************************************************************#
+
+def add_arguments(parser):
+    """
+    add the --progress_format and --progress_rate options to a parser.
+    """
+    parser.add_argument("--progress_format",
+                        choices=["text", "jsonl"],
+                        dest="progress_format",
+                        default="text",
+                        help=("text (processing file: ...) or jsonl (one "
+                              "JSON event per line: phase, progress and "
+                              "summary events)"))
+
+    parser.add_argument("--progress_rate",
+                        dest="progress_rate",
+                        default=RATE,
+                        type=float,
+                        help=("maximum number of jsonl progress events per "
+                              "second (default: {}, 0 for one event per "
+                              "file)".format(RATE)))
+
+
+def open_progress(args):
+    """
+    return a Progress object, or None if progress is printed as text.
+
+    In jsonl mode, stdout only receives the events: the other messages
+    of the script (printed to sys.stdout) go to stderr.
+    """
+    if args.progress_format != "jsonl":
+        return None
+    events = sys.stdout
+    sys.stdout = sys.stderr
+    return Progress(args.progress_rate, events)
+
+
+class Progress(object):
+    """
+    progress events, written as JSON lines to stdout.
+
+    Files are added to the total as they are found (add), and counted
+    as done when processed (done). Progress events are written at most
+    rate times per second (the last one of a phase is always written),
+    with the number of files and bytes done, their totals, and an
+    estimate of the remaining time (seconds). Totals and the estimate
+    are null until known: the number of files can be given when the
+    phase starts, the number of bytes is known once all files are added
+    (scanned). Other events (phase, summary) are written immediately.
+    """
+
+    def __init__(self, rate=RATE, file=None):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.file = file if file is not None else sys.stdout
+        self.lock = threading.Lock()
+        self.sizes = {}  # files added, not done yet -> size
+        self._reset(None)
+
+    def _reset(self, phase):
+        self.phase_name = phase
+        self.start = time.perf_counter()
+        self.last = 0.0
+        self.reported = 0  # files done in the last progress event
+        self.files_done = self.files_total = 0
+        self.bytes_done = self.bytes_total = 0
+        self.files_known = False  # files_total given by phase
+        self.complete = False  # all files added, see scanned
+
+    def emit(self, event, **fields):
+        record = {"event": event}
+        record.update(fields)
+        with self.lock:
+            print(json.dumps(record), file=self.file, flush=True)
+
+    def phase(self, name, files_total=None):
+        """
+        start a new phase (the number of files can be known, or counted
+        as files are added, see scanned).
+        """
+        self.end_phase()
+        self._reset(name)
+        if files_total is not None:
+            self.files_total = files_total
+            self.files_known = True
+        self.emit("phase", phase=name)
+
+    def add(self, filename, size=None):
+        """
+        add a file to the total (its size is read if not given).
+        """
+        if size is None:
+            try:
+                size = os.path.getsize(filename)
+            except OSError:
+                size = 0
+        with self.lock:
+            if not self.files_known:
+                self.files_total += 1
+            self.bytes_total += size
+            self.sizes[filename] = size
+
+    def scanned(self):
+        """
+        all the files of the phase are added: the totals are complete.
+        """
+        with self.lock:
+            self.complete = True
+
+    def done(self, filename=None):
+        """
+        count a file as done (and write a progress event if the last
+        one is old enough).
+        """
+        with self.lock:
+            self.files_done += 1
+            self.bytes_done += self.sizes.pop(filename, 0)
+            now = time.perf_counter()
+            if now - self.last < self.interval:
+                return
+            self.last = now
+        self._progress()
+
+    def _progress(self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.start
+            files_total = bytes_total = None
+            if self.files_known or self.complete:
+                files_total = self.files_total
+            if self.complete:
+                bytes_total = self.bytes_total
+            if bytes_total and self.bytes_done:
+                done, total = self.bytes_done, bytes_total
+            else:
+                done, total = self.files_done, files_total
+            eta = None
+            if done and total is not None and total >= done:
+                eta = round(elapsed * (total - done) / done, 1)
+            self.reported = self.files_done
+            fields = {"phase": self.phase_name,
+                      "files_done": self.files_done,
+                      "files_total": files_total,
+                      "bytes_done": self.bytes_done,
+                      "bytes_total": bytes_total,
+                      "elapsed": round(elapsed, 1),
+                      "eta": eta}
+        self.emit("progress", **fields)
+
+    def end_phase(self):
+        """
+        write the last progress event of the current phase (unless
+        already written).
+        """
+        if (self.phase_name is not None and
+                self.files_done != self.reported):
+            self._progress()
+        self.phase_name = None
+
+    def summary(self, **fields):
+        self.end_phase()
+        self.emit("summary", **fields)
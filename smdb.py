@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+read SMDB files, and compile them into binary indexes.
+
+A compiled index is a sorted, fixed-width binary version of a SMDB,
+stored next to it (SMDB file name + ".idx"). It is memory-mapped and
+searched by bisection, so opening it does not depend on the number of
+records. build_pack and verify_pack use it automatically when it is
+more recent than the SMDB text file.
+"""
+import os
+import sys
+import mmap
+import struct
+import argparse
+from collections import defaultdict
+
+
+__author__ = "aquaman"
+__date__ = "2026/10/18"
+__version__ = "$Revision: 1.1"
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Constants                                 #
+#                                                                      #
+# *********************************************************************#
+
+INDEX_SUFFIX = ".idx"
+MAGIC = b"SMDBIDX\x01"
+# magic, number of entries, number of distinct sizes, flags, offset
+# of the sha256 table, offset and length of the crc32 table, offsets
+# of the size and path tables (entries start right after the header)
+HEADER = struct.Struct("<8sQQQQQQQQ")
+ENTRY = struct.Struct("<32sQII")  # sha256, size, path offset, path length
+SHA256_RECORD = struct.Struct("<32sI")  # sha256, entry number
+CRC32_RECORD = struct.Struct("<4sI")  # crc32, entry number
+SIZE_RECORD = struct.Struct(">Q")  # big-endian, sorts like numbers
+UNKNOWN_SIZE = 2 ** 64 - 1
+ALL_SIZES = 1  # flag: all records have a file size
+LISTS_ZIP = 2  # flag: at least one record is a zip archive
+
+
+# *********************************************************************#
+#                                                                      #
+#                            Functions                                 #
+#                                                                      #
+# *********************************************************************#
+
+def option_parse():
+    """
+    Parse arguments from command line.
+    """
+    parser = argparse.ArgumentParser(
+        description="compile SMDB files into binary indexes.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    compile_parser = subparsers.add_parser(
+        "compile", help="compile SMDB files (output: SMDB file + .idx)")
+    compile_parser.add_argument("target_databases",
+                                nargs="+",
+                                help="set target databases")
+
+    return parser.parse_args()
+
+
+def read_records(target_database):
+    """
+    yield (sha256, filename, crc32, size) tuples. CRC32 and size are
+    None when the corresponding column is missing.
+    """
+    with open(target_database, "r") as target_database:
+        for line in target_database:
+            columns = line.strip().split("\t")
+            crc32 = columns[4] if len(columns) > 4 else None
+            size = None
+            if len(columns) > 5 and columns[5].isdigit():
+                size = int(columns[5])
+            yield columns[0], columns[1], crc32, size
+
+
+def index_filename(target_database):
+    return target_database + INDEX_SUFFIX
+
+
+def compile_database(target_database, output_file=None):
+    """
+    write the binary index of a SMDB file.
+    """
+    output_file = output_file or index_filename(target_database)
+    entries = []
+    paths = {}  # interned path table: path -> offset
+    path_table = bytearray()
+    sha256_records = []
+    crc32_records = []
+    sizes = set()
+    flags = ALL_SIZES
+    for number, (sha256, filename, crc32, size) in enumerate(
+            read_records(target_database)):
+        path = filename.encode("utf-8")
+        if path not in paths:
+            paths[path] = len(path_table)
+            path_table += path
+        if size is None:
+            flags &= ~ALL_SIZES
+            size = UNKNOWN_SIZE
+        else:
+            sizes.add(size)
+        if filename.lower().endswith(".zip"):
+            flags |= LISTS_ZIP
+        sha256 = bytes.fromhex(sha256)
+        entries.append(ENTRY.pack(sha256, size, paths[path], len(path)))
+        sha256_records.append((sha256, number))
+        if crc32:
+            crc32_records.append((bytes.fromhex(crc32), number))
+    sha256_records.sort()
+    crc32_records.sort()
+
+    entries_offset = HEADER.size
+    sha256_offset = entries_offset + ENTRY.size * len(entries)
+    crc32_offset = sha256_offset + SHA256_RECORD.size * len(sha256_records)
+    sizes_offset = crc32_offset + CRC32_RECORD.size * len(crc32_records)
+    paths_offset = sizes_offset + SIZE_RECORD.size * len(sizes)
+
+    temporary_file = output_file + ".tmp"
+    with open(temporary_file, "wb") as index:
+        index.write(HEADER.pack(MAGIC, len(entries), len(sizes), flags,
+                                sha256_offset, crc32_offset,
+                                len(crc32_records), sizes_offset,
+                                paths_offset))
+        index.write(b"".join(entries))
+        index.write(b"".join(SHA256_RECORD.pack(*record)
+                             for record in sha256_records))
+        index.write(b"".join(CRC32_RECORD.pack(*record)
+                             for record in crc32_records))
+        index.write(b"".join(SIZE_RECORD.pack(size)
+                             for size in sorted(sizes)))
+        index.write(path_table)
+    os.replace(temporary_file, output_file)
+    return len(entries)
+
+
+def open_index(target_database):
+    """
+    return the compiled index of a SMDB file if it exists and is more
+    recent than the SMDB file, otherwise parse the SMDB file.
+    """
+    compiled = index_filename(target_database)
+    try:
+        if os.path.getmtime(compiled) >= os.path.getmtime(target_database):
+            return CompiledIndex(compiled)
+    except (OSError, ValueError):
+        pass  # no index, or unreadable index
+    return TextIndex(target_database)
+
+
+class TextIndex(object):
+    """
+    SMDB file parsed in memory. Entries are numbered in file order.
+    """
+
+    def __init__(self, target_database):
+        self.filenames = []
+        self.sha256s = []
+        self.by_digest = defaultdict(list)  # digest -> entry numbers
+        self.sizes = set()
+        self.all_sizes = True
+        self.lists_zip = False
+        for number, (sha256, filename, crc32, size) in enumerate(
+                read_records(target_database)):
+            self.filenames.append(filename)
+            self.sha256s.append(sha256)
+            self.by_digest[sha256].append(number)
+            if crc32:
+                self.by_digest[crc32].append(number)
+            if size is None:
+                self.all_sizes = False
+            else:
+                self.sizes.add(size)
+            if filename.lower().endswith(".zip"):
+                self.lists_zip = True
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def lookup(self, digest):
+        return self.by_digest.get(digest, [])
+
+    def filename(self, entry):
+        return self.filenames[entry]
+
+    def sha256(self, entry):
+        return self.sha256s[entry]
+
+    def has_size(self, size):
+        return size in self.sizes
+
+
+class CompiledIndex(object):
+    """
+    memory-mapped compiled index (see compile_database).
+    """
+
+    def __init__(self, compiled):
+        with open(compiled, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.entries, self.number_of_sizes, flags,
+         self.sha256_offset, self.crc32_offset, self.number_of_crc32s,
+         self.sizes_offset, self.paths_offset) = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError("{} is not a compiled SMDB".format(compiled))
+        self.all_sizes = bool(flags & ALL_SIZES)
+        self.lists_zip = bool(flags & LISTS_ZIP)
+
+    def __len__(self):
+        return self.entries
+
+    def _bisect(self, offset, count, record, key):
+        """
+        return the range of records starting with key, in a table
+        sorted by key.
+        """
+        width = len(key)
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            start = offset + middle * record.size
+            if self.map[start:start + width] < key:
+                low = middle + 1
+            else:
+                high = middle
+        first, high = low, count
+        while low < high:
+            middle = (low + high) // 2
+            start = offset + middle * record.size
+            if self.map[start:start + width] <= key:
+                low = middle + 1
+            else:
+                high = middle
+        return first, low
+
+    def lookup(self, digest):
+        if len(digest) == 64:
+            offset, count, record = (self.sha256_offset, self.entries,
+                                     SHA256_RECORD)
+        elif len(digest) == 8:
+            offset, count, record = (self.crc32_offset,
+                                     self.number_of_crc32s, CRC32_RECORD)
+        else:
+            return []
+        try:
+            key = bytes.fromhex(digest)
+        except ValueError:
+            return []
+        first, last = self._bisect(offset, count, record, key)
+        return [record.unpack_from(self.map, offset + i * record.size)[1]
+                for i in range(first, last)]
+
+    def _entry(self, entry):
+        return ENTRY.unpack_from(self.map, HEADER.size + entry * ENTRY.size)
+
+    def filename(self, entry):
+        _, _, path_offset, path_length = self._entry(entry)
+        start = self.paths_offset + path_offset
+        return self.map[start:start + path_length].decode("utf-8")
+
+    def sha256(self, entry):
+        return self._entry(entry)[0].hex()
+
+    def has_size(self, size):
+        first, last = self._bisect(self.sizes_offset, self.number_of_sizes,
+                                   SIZE_RECORD, SIZE_RECORD.pack(size))
+        return first < last
+
+
+class Sizes(object):
+    """
+    set-like view of the file sizes listed in an index (membership
+    tests only).
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def __contains__(self, size):
+        return self.index.has_size(size)
+
+
+class Digests(object):
+    """
+    set-like view of the digests of a given length listed in an index
+    (membership tests only).
+    """
+
+    def __init__(self, index, length):
+        self.index = index
+        self.length = length
+
+    def __contains__(self, digest):
+        return len(digest) == self.length and bool(self.index.lookup(digest))
+
+
+class Union(object):
+    """
+    set-like union of several containers (membership tests only).
+    """
+
+    def __init__(self, containers):
+        self.containers = list(containers)
+
+    def __contains__(self, item):
+        return any(item in container for container in self.containers)
+
+
+class Database(object):
+    """
+    entries of a SMDB (numbered in file order), searchable by sha256
+    and crc32 values. Entries found while building or verifying a pack
+    are tracked in a bitmap (one byte per entry).
+    """
+
+    def __init__(self, index, drop_initial_directory=False):
+        self.index = index
+        self.drop_initial_directory = drop_initial_directory
+        self.number_of_entries = len(index)
+        self.found = bytearray(self.number_of_entries)
+        self.sizes = Sizes(index) if index.all_sizes else None
+        self.crcs = Digests(index, 8)
+        self.lists_zip = index.lists_zip
+
+    def lookup(self, digest):
+        """
+        return the entries matching a sha256 or crc32 value.
+        """
+        return self.index.lookup(digest)
+
+    def pending(self, digest):
+        """
+        return the entries matching a sha256 or crc32 value, and not
+        found yet.
+        """
+        return [entry for entry in self.index.lookup(digest)
+                if not self.found[entry]]
+
+    def mark_found(self, entry):
+        self.found[entry] = 1
+
+    def missing(self):
+        """
+        return the entries not found yet.
+        """
+        return [entry for entry, found in enumerate(self.found)
+                if not found]
+
+    def filename(self, entry):
+        filename = self.index.filename(entry)
+        if self.drop_initial_directory:
+            first_level, filename = filename.split("/", 1)
+        return os.path.normpath(filename)
+
+    def sha256(self, entry):
+        return self.index.sha256(entry)
+
+
+# *********************************************************************#
+#                                                                      #
+#                              Body                                    #
+#                                                                      #
+# *********************************************************************#
+
+if __name__ == '__main__':
+    args = option_parse()
+    if args.command == "compile":
+        for target_database in args.target_databases:
+            entries = compile_database(target_database)
+            print("{}: {} entries".format(index_filename(target_database),
+                                          entries), file=sys.stdout)
+
+    sys.exit(0)
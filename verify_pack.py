@@ -5,14 +5,21 @@ Use a database to verify files.
 """
 import os
 import sys
-import hashlib
 import argparse
-from collections import defaultdict
+import smdb
+import metrics
+import hashing
+import progress
+import hash_cache
 
 
 __author__ = "Steve Matos (parts by aquaman)"
-__date__ = "2020/11/28"
-__version__ = "$Revision: 1.0"
+__date__ = "2026/10/18"
+__version__ = "$Revision: 1.7"
+
+HASH_CACHE = None  # set when the script is run, see hash_cache.py
+METRICS = metrics.Metrics()  # run statistics, see metrics.py
+PROGRESS = None  # jsonl progress events, see progress.py
 
 
 # *********************************************************************#
@@ -72,27 +79,47 @@ if __name__ == '__main__':
                         help=("Drops the 1st directory path in the SMDB file "
                               "so you can customize the name."))
 
+    parser.add_argument("--cache",
+                        dest="cache_file",
+                        default=None,
+                        help=("set hash cache file (default: {})".format(
+                            hash_cache.default_cache_path())))
+
+    # Valid uses of this flag include: --no_cache, --no_cache true
+    parser.add_argument("--no_cache",
+                        dest="no_cache",
+                        default=False,
+                        nargs="?",
+                        const=True,
+                        type='bool',
+                        help=("Do not read or update the hash cache, "
+                              "hash every file."))
+
+    # Valid uses of this flag include: --rebuild_cache, --rebuild_cache 1
+    parser.add_argument("--rebuild_cache",
+                        dest="rebuild_cache",
+                        default=False,
+                        nargs="?",
+                        const=True,
+                        type='bool',
+                        help=("Ignore cached hash values, hash every file "
+                              "and refresh the hash cache."))
+
+    metrics.add_arguments(parser)
+    progress.add_arguments(parser)
+
     ARGS = parser.parse_args()
 
 
 def parse_database(target_database, drop_initial_directory):
     """
-    Store hash values and filenames in a database.
+    Store hash values and filenames in a database (see smdb.py, a
+    compiled index is used when available).
     """
-    db = defaultdict(list)  # missing key's default value is an empty list
-    number_of_entries = 0
-    with open(target_database, "r") as target_database:
-        for line in target_database:
-            hash_sha256, filename, other_hash = line.strip().split("\t", 2)
-            number_of_entries += 1
-
-            if drop_initial_directory:
-                first_level, filename = filename.split("/", 1)
-
-            filename = os.path.normpath(filename)
-            db[hash_sha256].append(filename)
+    db = smdb.Database(smdb.open_index(target_database),
+                       drop_initial_directory)
 
-    return db, number_of_entries
+    return db, db.number_of_entries
 
 
 def print_progress(current, total, end):
@@ -110,8 +137,17 @@ def parse_folder(target_folder, db):
      determine if it is in the correct location.
     """
     current_file = 0
-    total_files = len([os.path.join(dp, f) for dp, dn, fn in
-                       os.walk(os.path.expanduser(target_folder)) for f in fn])
+    with METRICS.phase("walk"):
+        all_files = [os.path.join(os.path.normpath(dp), os.path.normpath(f))
+                     for dp, dn, fn in
+                     os.walk(os.path.expanduser(target_folder))
+                     for f in fn]
+    total_files = len(all_files)
+    if PROGRESS:
+        PROGRESS.phase("verify")
+        for filename in all_files:
+            PROGRESS.add(filename)
+        PROGRESS.scanned()
 
     bad_location_files = []
     extra_files = []
@@ -120,19 +156,27 @@ def parse_folder(target_folder, db):
             for f in filenames:
                 filename = os.path.join(os.path.normpath(dirpath),
                                         os.path.normpath(f))
+                if hash_cache.is_cache_file(filename, HASH_CACHE):
+                    current_file += 1
+                    if PROGRESS:
+                        PROGRESS.done(filename)
+                    continue
                 absolute_filename = u'\\\\?\\' + os.path.abspath(filename)
                 try:
                     hash_sha256 = get_hash(filename)
                 except FileNotFoundError:
                     hash_sha256 = get_hash(absolute_filename)
 
-                if hash_sha256 in db:
+                entries = db.lookup(hash_sha256)
+                if entries:
                     rel_path = os.path.relpath(filename, target_folder)
 
-                    if rel_path in db[hash_sha256]:
-                        # file found (correct location)
-                        # remove file name from database
-                        db[hash_sha256].remove(rel_path)
+                    for entry in entries:
+                        if (not db.found[entry] and
+                                db.filename(entry) == rel_path):
+                            # file found (correct location)
+                            db.mark_found(entry)
+                            break
                     else:
                         # hash in database (file in bad location)
                         bad_location_files.append((filename, hash_sha256))
@@ -141,9 +185,14 @@ def parse_folder(target_folder, db):
                     extra_files.append((filename, hash_sha256))
 
                 current_file += 1
-                print_progress(current_file, total_files, END_LINE)
+                if PROGRESS:
+                    PROGRESS.done(filename)
+                else:
+                    print_progress(current_file, total_files, END_LINE)
     else:
-        if not ARGS.new_line:
+        if PROGRESS:
+            PROGRESS.end_phase()
+        elif not ARGS.new_line:
             print_progress(current_file, total_files, "\n")
 
     return bad_location_files, extra_files
@@ -153,14 +202,20 @@ def get_hash(filename):
     """
     Return sha256 hash of the file.
     """
-    h = hashlib.sha256()
-    with open(filename, "rb", buffering=0) as f:
-        # use a small buffer to compute hash to
-        # avoid memory overload
-        for b in iter(lambda: f.read(128 * 1024), b''):
-            h.update(b)
+    # hash value computed during a previous run
+    if HASH_CACHE:
+        st, record = HASH_CACHE.lookup(filename)
+        if record["sha256"]:
+            return record["sha256"]
+
+    with METRICS.phase("sha256", "bytes_read") as phase:
+        sha256 = hashing.hash_file(filename, ("sha256",), phase)["sha256"]
+    METRICS.count("files_hashed")
+
+    if HASH_CACHE:
+        HASH_CACHE.store(filename, st, {"sha256": sha256})
 
-    return h.hexdigest()
+    return sha256
 
 
 # *********************************************************************#
@@ -170,20 +225,30 @@ def get_hash(filename):
 # *********************************************************************#
 
 if __name__ == '__main__':
+    METRICS.configure(ARGS)
+    PROGRESS = progress.open_progress(ARGS)
     TARGET_FOLDER = ARGS.target_folder
     TARGET_DATABASE = ARGS.target_database
     MISMATCH_FILES = ARGS.mismatch_files
     END_LINE = "\n" if ARGS.new_line else "\r"
     DROP_INITIAL_DIRECTORY = ARGS.drop_initial_directory
 
-    DATABASE, NUMBER_OF_ENTRIES = parse_database(TARGET_DATABASE,
-                                                 DROP_INITIAL_DIRECTORY)
+    HASH_CACHE = hash_cache.open_cache(ARGS.cache_file,
+                                       ARGS.no_cache,
+                                       ARGS.rebuild_cache)
+
+    if PROGRESS:
+        PROGRESS.phase("load")
+    with METRICS.phase("load database"):
+        DATABASE, NUMBER_OF_ENTRIES = parse_database(TARGET_DATABASE,
+                                                     DROP_INITIAL_DIRECTORY)
     BAD_LOCATION_FILES, EXTRA_FILES = parse_folder(TARGET_FOLDER, DATABASE)
 
-    MISSING_FILES = []
-    for key in DATABASE:
-        for file in DATABASE[key]:
-            MISSING_FILES.append((file, key))
+    if HASH_CACHE:
+        HASH_CACHE.close()
+
+    MISSING_FILES = [(DATABASE.filename(entry), DATABASE.sha256(entry))
+                     for entry in DATABASE.missing()]
 
     # write information to log file only if there are any bad, extra
     # or missing files to report
@@ -217,5 +282,20 @@ if __name__ == '__main__':
           file=sys.stdout)
     print("extra: {}".format(len(EXTRA_FILES)), file=sys.stdout)
     print("missing: {}".format(len(MISSING_FILES)), file=sys.stdout)
+    if HASH_CACHE:
+        print(HASH_CACHE.summary(), file=sys.stdout)
+    if PROGRESS:
+        FOUND_ENTRIES = NUMBER_OF_ENTRIES - len(MISSING_FILES)
+        PROGRESS.summary(database=TARGET_DATABASE,
+                         entries=NUMBER_OF_ENTRIES,
+                         found=FOUND_ENTRIES,
+                         missing=len(MISSING_FILES),
+                         incorrect_location=len(BAD_LOCATION_FILES),
+                         extra=len(EXTRA_FILES),
+                         coverage=round(100.0 * FOUND_ENTRIES /
+                                        NUMBER_OF_ENTRIES, 2)
+                         if NUMBER_OF_ENTRIES else 0.0)
+
+    METRICS.finish(ARGS)
 
     sys.exit(0)